@@ -0,0 +1,114 @@
+"""
+省メモリモードのベンチマーク
+
+UIManagerを起動し、通知表示直後（アクティブ）と省メモリモード移行後（アイドル）の
+RSSとPythonヒープ確保量（tracemalloc）を比較する。
+
+使い方:
+    python bench_idle_memory.py [--idle-timeout 秒]
+"""
+import argparse
+import codecs
+import gc
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from types import SimpleNamespace
+
+from config_manager import ConfigManager
+from event_bus import EventBus, VolumeChanged
+from ui_manager import UIManager
+
+# Windows環境で絵文字を表示するためのエンコーディング設定
+if sys.platform == 'win32':
+    sys.stdout = codecs.getwriter('utf-8')(sys.stdout.buffer, 'strict')
+    sys.stderr = codecs.getwriter('utf-8')(sys.stderr.buffer, 'strict')
+
+def get_rss_bytes():
+    """現在のプロセスの常駐メモリ（RSS）をバイト単位で取得する"""
+    if sys.platform == 'win32':
+        import ctypes
+        from ctypes import wintypes
+
+        class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+            _fields_ = [
+                ("cb", wintypes.DWORD),
+                ("PageFaultCount", wintypes.DWORD),
+                ("PeakWorkingSetSize", ctypes.c_size_t),
+                ("WorkingSetSize", ctypes.c_size_t),
+                ("QuotaPeakPagedPoolUsage", ctypes.c_size_t),
+                ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
+                ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                ("PagefileUsage", ctypes.c_size_t),
+                ("PeakPagefileUsage", ctypes.c_size_t),
+            ]
+
+        counters = PROCESS_MEMORY_COUNTERS()
+        counters.cb = ctypes.sizeof(counters)
+        process = ctypes.windll.kernel32.GetCurrentProcess()
+        ctypes.windll.psapi.GetProcessMemoryInfo(process, ctypes.byref(counters), counters.cb)
+        return counters.WorkingSetSize
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+def measure(label):
+    gc.collect()
+    rss = get_rss_bytes()
+    current, _ = tracemalloc.get_traced_memory()
+    print(f"[計測] {label:<12} RSS: {rss / 1024 / 1024:8.2f} MB / Pythonヒープ: {current / 1024:8.1f} KB")
+    return rss, current
+
+def wait_until(predicate, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.05)
+    return False
+
+def main():
+    parser = argparse.ArgumentParser(description="省メモリモードのメモリ使用量を比較する")
+    parser.add_argument("--idle-timeout", type=float, default=2.0, help="省メモリモードまでの秒数")
+    args = parser.parse_args()
+
+    tracemalloc.start()
+    with tempfile.TemporaryDirectory() as tmp:
+        config_manager = ConfigManager(os.path.join(tmp, "settings.json"))
+        config_manager.set("idle_timeout", args.idle_timeout)
+        app = SimpleNamespace(config_manager=config_manager, profiler=None)
+        ui = UIManager(None, parent_app=app)
+        # アプリと同じく、OSD・トレイアイコンはイベントバス経由で更新する
+        event_bus = EventBus()
+        ui.subscribe(event_bus)
+
+        # 通知を出してOSD・アイコンキャッシュを使った状態にする
+        for level in range(0, 101, 5):
+            event_bus.publish(VolumeChanged(volume=level, muted=False))
+            time.sleep(0.02)
+        time.sleep(1.0)
+        active = measure("アクティブ")
+
+        if not wait_until(lambda: ui.is_idle, args.idle_timeout + 5):
+            print("[エラー] 省メモリモードに移行しませんでした")
+            ui.close()
+            return 1
+        time.sleep(0.5)
+        idle = measure("アイドル")
+
+        # 復帰にかかる時間も確認する
+        started = time.perf_counter()
+        event_bus.publish(VolumeChanged(volume=50, muted=False))
+        wait_until(lambda: ui._root is not None, 5)
+        print(f"[計測] 復帰時間: {(time.perf_counter() - started) * 1000:.1f} ms")
+
+        print(f"[結果] RSS差分: {(active[0] - idle[0]) / 1024 / 1024:.2f} MB"
+              f" / Pythonヒープ差分: {(active[1] - idle[1]) / 1024:.1f} KB")
+        ui.close()
+        event_bus.close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
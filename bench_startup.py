@@ -0,0 +1,96 @@
+"""
+起動時間のベンチマーク
+
+VolumeControl の初期化を、スナップショットなし（従来の起動: 既定デバイスをアクティベートしてから
+保存されたデバイスに切り替える）と、スナップショットあり（保存されたデバイスだけをアクティベートし、
+列挙はバックグラウンドに回す）とで比較する。既定以外の再生デバイスがあれば、それを保存済みとして扱う。
+
+「起動」はメインスレッドが待つ時間（VolumeControlの構築）、「照合込み」はそれに
+バックグラウンドで行うデバイス一覧の列挙（main.py の起動時の照合と同じ処理）を足した時間。
+どちらの手順でも列挙は起動後に1回だけ行うため、照合込みの差はアクティベートの削減分にとどまる。
+
+使い方:
+    python bench_startup.py [--rounds 回数]
+"""
+import argparse
+import codecs
+import contextlib
+import io
+import statistics
+import sys
+import time
+
+from volume_control import VolumeControl
+
+# Windows環境で絵文字を表示するためのエンコーディング設定
+if sys.platform == 'win32':
+    sys.stdout = codecs.getwriter('utf-8')(sys.stdout.buffer, 'strict')
+    sys.stderr = codecs.getwriter('utf-8')(sys.stderr.buffer, 'strict')
+
+def cold_start(device_id):
+    """従来の起動手順"""
+    volume_control = VolumeControl()
+    volume_control.set_audio_device(device_id)
+    return volume_control
+
+def warm_start(device_id, endpoints):
+    """スナップショットを使った起動手順"""
+    return VolumeControl(device_id=device_id, endpoints=endpoints)
+
+def measure(start):
+    # 各モジュールのログは計測に含めない
+    with contextlib.redirect_stdout(io.StringIO()):
+        started = time.perf_counter()
+        volume_control = start()
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        # 0なら起動時に列挙していない
+        enumerations = volume_control.registry.version
+        activations = len(volume_control.registry._volume_cache)
+        # 起動後の照合で行う列挙
+        reconcile_started = time.perf_counter()
+        volume_control.get_audio_devices()
+        reconcile_ms = (time.perf_counter() - reconcile_started) * 1000
+        volume_control.cleanup()
+    return {
+        "ms": elapsed_ms,
+        "total_ms": elapsed_ms + reconcile_ms,
+        "enumerations": enumerations,
+        "activations": activations,
+    }
+
+def report(label, samples):
+    times = [sample["ms"] for sample in samples]
+    totals = [sample["total_ms"] for sample in samples]
+    print(f"[計測] {label:<16} 起動 中央値: {statistics.median(times):7.1f} ms / 最大: {max(times):7.1f} ms"
+          f" / 照合込み 中央値: {statistics.median(totals):7.1f} ms"
+          f" / 起動中の列挙: {samples[-1]['enumerations']}回 / アクティベート: {samples[-1]['activations']}個")
+    return statistics.median(times), statistics.median(totals)
+
+def main():
+    parser = argparse.ArgumentParser(description="スナップショットによる起動時間の短縮を計測する")
+    parser.add_argument("--rounds", type=int, default=10, help="各手順の計測回数")
+    args = parser.parse_args()
+
+    # 計測対象のデバイスとスナップショットの内容を用意する
+    with contextlib.redirect_stdout(io.StringIO()):
+        probe = VolumeControl()
+        devices = probe.get_audio_devices()
+        endpoints = probe.registry.export()
+        probe.cleanup()
+    selected = next((d for d in devices if not d["is_default"]), devices[0])
+    print(f"[設定] 保存済みデバイス: {selected['name']}{' (既定)' if selected['is_default'] else ''}")
+
+    cold, warm = [], []
+    # OS側のキャッシュの影響を均すため交互に計測する
+    for _ in range(args.rounds):
+        cold.append(measure(lambda: cold_start(selected["id"])))
+        warm.append(measure(lambda: warm_start(selected["id"], endpoints)))
+
+    cold_ms, cold_total_ms = report("スナップショットなし", cold)
+    warm_ms, warm_total_ms = report("スナップショットあり", warm)
+    print(f"[結果] 起動の短縮: {cold_ms - warm_ms:.1f} ms ({(1 - warm_ms / cold_ms) * 100:.0f}%)"
+          f" / 照合込みの短縮: {cold_total_ms - warm_total_ms:.1f} ms")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,247 @@
+"""
+VolumeScheduler の日時計算・cap の期間判定の検証
+
+スケジューラの時刻計算は純粋なPythonのため、Windows以外（Linux等）でも検証できる。
+壁時計・モノトニック時計・待機を模擬した時計に差し替えてスケジューラのループを回し、
+ルールの実行順と音量上限の変化を確認する。
+
+検証する内容:
+    - next_occurrence / previous_occurrence / cap_window_end の日付・曜日の計算
+    - 起動時に cap の期間内であれば、その場で上限を適用し、until で解除する
+    - until のない cap は、より後の時刻に別のルールが実行された時点で終わる
+    - 同時刻に実行されるルールの処理順で結果が変わらない
+    - 時計の変更を検出した起床時に、その時刻のルールを捨てない（戻った場合は二度実行しない）
+
+使い方:
+    python check_volume_scheduler.py
+"""
+import codecs
+import contextlib
+import io
+import sys
+import time
+import types
+from datetime import datetime, timedelta
+
+import volume_scheduler
+from volume_scheduler import VolumeScheduler, next_occurrence, previous_occurrence, cap_window_end
+
+# Windows環境で絵文字を表示するためのエンコーディング設定
+if sys.platform == 'win32':
+    sys.stdout = codecs.getwriter('utf-8')(sys.stdout.buffer, 'strict')
+    sys.stderr = codecs.getwriter('utf-8')(sys.stderr.buffer, 'strict')
+
+# 2026-10-19 は月曜日
+MONDAY = datetime(2026, 10, 19)
+
+# --- 模擬した時計と VolumeControl ---
+
+class FakeClock:
+    """壁時計とモノトニック時計。壁時計だけを動かすと時計の変更になる"""
+
+    def __init__(self, start):
+        self.wall = start.timestamp()
+        self.mono = 1000.0
+
+    def time(self):
+        return self.wall
+
+    def monotonic(self):
+        return self.mono
+
+    def now(self):
+        return datetime.fromtimestamp(self.wall)
+
+class FakeWaiter:
+    """wait_until() で時計を進める。steps の各要素が1回の待機の進め方を決める"""
+
+    def __init__(self, clock, scheduler, steps):
+        self.clock = clock
+        self.scheduler = scheduler
+        self.steps = list(steps)
+
+    def wake(self):
+        pass
+
+    def wait_until(self, due_ts):
+        if not self.steps or due_ts is None:
+            self.scheduler._stopped = True
+            return
+        self.steps.pop(0)(self.clock, due_ts)
+
+def until_due(clock, due_ts):
+    """予定時刻まで時計どおりに待つ"""
+    clock.mono += due_ts - clock.wall
+    clock.wall = due_ts
+
+def jump_during_wait(seconds):
+    """待機中に壁時計が seconds 秒変更され、予定時刻（絶対時刻）に起きる"""
+    def step(clock, due_ts):
+        clock.mono += due_ts - clock.wall - seconds
+        clock.wall = due_ts
+    return step
+
+def jump_now(seconds, elapsed=1.0):
+    """elapsed 秒待った時点で壁時計が seconds 秒変更され、予定時刻の前に起きる"""
+    def step(clock, due_ts):
+        clock.mono += elapsed
+        clock.wall += elapsed + seconds
+    return step
+
+class FakeVolumeControl:
+    """batch() と set_volume_limit() を記録する"""
+
+    def __init__(self, clock):
+        self.clock = clock
+        self.volume = 50
+        self.muted = False
+        self.limit = None
+        self.limits = []
+        self.applied = []
+
+    def set_volume_limit(self, limit):
+        self.limit = limit
+        self.limits.append(limit)
+        if limit is not None:
+            self.volume = min(self.volume, limit)
+
+    def batch(self, ops):
+        results = []
+        for op in ops:
+            if op[0] in ("set", "cap", "mute"):
+                self.applied.append((self.clock.now().strftime("%m-%d %H:%M"),) + op)
+            if op[0] == "set":
+                self.volume = op[1] if self.limit is None else min(op[1], self.limit)
+                results.append(None)
+            elif op[0] == "cap":
+                self.volume = min(self.volume, op[1])
+                results.append(None)
+            elif op[0] == "mute":
+                self.muted = op[1]
+                results.append(None)
+            elif op[0] == "get":
+                results.append(self.volume)
+            elif op[0] == "is_muted":
+                results.append(self.muted)
+        return results
+
+@contextlib.contextmanager
+def fake_clock(clock):
+    """volume_scheduler の time / datetime を模擬した時計に差し替える"""
+    class FakeDatetime(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return clock.now()
+    original = (volume_scheduler.time, volume_scheduler.datetime)
+    volume_scheduler.time = types.SimpleNamespace(
+        time=clock.time, monotonic=clock.monotonic, perf_counter=time.perf_counter
+    )
+    volume_scheduler.datetime = FakeDatetime
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            yield
+    finally:
+        volume_scheduler.time, volume_scheduler.datetime = original
+
+def run_scheduler(start, rules, steps):
+    """start から rules でスケジューラを回し、steps の待機を終えたら止める"""
+    clock = FakeClock(start)
+    volume_control = FakeVolumeControl(clock)
+    with fake_clock(clock):
+        scheduler = VolumeScheduler(volume_control)
+        scheduler._waiter = FakeWaiter(clock, scheduler, steps)
+        scheduler.update_rules(rules)
+        scheduler._loop()
+        next_runs = scheduler.get_next_runs()
+    return volume_control, next_runs
+
+# --- 検証 ---
+
+def expect(failures, name, actual, expected):
+    if actual != expected:
+        failures.append(f"{name}: {actual!r} (期待値 {expected!r})")
+
+def check_occurrences(failures):
+    daily = {"time": "09:00"}
+    weekdays = {"time": "09:00", "days": [0, 1, 2, 3, 4]}
+    monday_9 = MONDAY.replace(hour=9)
+    expect(failures, "next: 同時刻の次は翌日", next_occurrence(daily, monday_9), monday_9 + timedelta(days=1))
+    expect(failures, "next: 直前は当日", next_occurrence(daily, monday_9 - timedelta(minutes=1)), monday_9)
+    friday_10 = MONDAY.replace(hour=10) + timedelta(days=4)
+    expect(failures, "next: 金曜の後は月曜", next_occurrence(weekdays, friday_10), monday_9 + timedelta(days=7))
+    expect(failures, "previous: 同時刻を含む", previous_occurrence(daily, monday_9), monday_9)
+    expect(failures, "previous: 直前は前日",
+           previous_occurrence(daily, monday_9 - timedelta(minutes=1)), monday_9 - timedelta(days=1))
+    sunday_12 = MONDAY.replace(hour=12) - timedelta(days=1)
+    expect(failures, "previous: 日曜の前は金曜", previous_occurrence(weekdays, sunday_12), monday_9 - timedelta(days=3))
+    night = {"time": "22:00", "until": "07:00", "action": "cap", "value": 30}
+    expect(failures, "cap_window_end: 日付をまたぐ",
+           cap_window_end(night, MONDAY.replace(hour=22)), MONDAY.replace(hour=7) + timedelta(days=1))
+    expect(failures, "cap_window_end: untilなし", cap_window_end({"time": "22:00"}, MONDAY), None)
+
+def check_cap_window(failures):
+    night = {"id": "night", "time": "22:00", "until": "07:00", "action": "cap", "value": 30}
+    # 期間の途中（23:30）に起動: その場で上限を適用し、07:00 に解除する
+    vc, next_runs = run_scheduler(MONDAY.replace(hour=23, minute=30), [night], [until_due])
+    expect(failures, "cap: 期間内の起動で適用・untilで解除", vc.limits, [30, None])
+    expect(failures, "cap: 次回の開始", next_runs.get("night"), "2026-10-20T22:00:00")
+    # 期間外（08:00）に起動: 22:00 まで適用しない
+    vc, _ = run_scheduler(MONDAY.replace(hour=8), [night], [])
+    expect(failures, "cap: 期間外の起動では適用しない", vc.limits, [])
+
+def check_open_cap(failures):
+    cap = {"id": "evening", "time": "21:00", "action": "cap", "value": 30}
+    morning = {"id": "morning", "time": "08:00", "action": "set", "value": 60}
+    # 21:00 の後に起動: 上限を適用し、08:00 の set で解除する
+    vc, _ = run_scheduler(MONDAY.replace(hour=22), [cap, morning], [until_due])
+    expect(failures, "untilなしcap: 別のルールで解除", vc.limits, [30, None])
+    expect(failures, "untilなしcap: 解除後のset", vc.volume, 60)
+    # 08:00 の後・21:00 の前に起動: 期間外
+    vc, _ = run_scheduler(MONDAY.replace(hour=12), [cap, morning], [])
+    expect(failures, "untilなしcap: 別のルールの後は期間外", vc.limits, [])
+
+def check_simultaneous(failures):
+    cap = {"id": "cap", "time": "09:00", "action": "cap", "value": 30}
+    loud = {"id": "loud", "time": "09:00", "action": "set", "value": 80}
+    for order in ([cap, loud], [loud, cap]):
+        label = " → ".join(rule["id"] for rule in order)
+        vc, _ = run_scheduler(MONDAY.replace(hour=8, minute=59), order, [until_due])
+        expect(failures, f"同時刻 ({label}): 上限", vc.limit, 30)
+        expect(failures, f"同時刻 ({label}): 音量", vc.volume, 30)
+        # 前日 09:00 の cap も同時刻の set では終わらないため、起動時（08:59）にも適用される
+        expect(failures, f"同時刻 ({label}): 起動時の適用", vc.applied[0], ("10-19 08:59", "cap", 30))
+        expect(failures, f"同時刻 ({label}): 09:00 の実行数",
+               len([op for op in vc.applied if op[0] == "10-19 09:00"]), 2)
+
+def check_clock_jump(failures):
+    morning = {"id": "morning", "time": "09:00", "action": "set", "value": 60}
+    # 08:00 から待機中に時計が5秒進められ、09:00 に起きる: 09:00 のルールを実行する
+    vc, next_runs = run_scheduler(MONDAY.replace(hour=8), [morning], [jump_during_wait(5)])
+    expect(failures, "時計が進んだ: 実行", vc.applied, [("10-19 09:00", "set", 60)])
+    expect(failures, "時計が進んだ: 次回", next_runs.get("morning"), "2026-10-20T09:00:00")
+    # 09:00 に実行した後に時計が10秒戻る: 同じ回を二度実行しない
+    vc, next_runs = run_scheduler(MONDAY.replace(hour=8), [morning], [until_due, jump_now(-10)])
+    expect(failures, "時計が戻った: 実行は1回", vc.applied, [("10-19 09:00", "set", 60)])
+    expect(failures, "時計が戻った: 次回", next_runs.get("morning"), "2026-10-20T09:00:00")
+    # 時計の変更を何度検出しても予定は翌日以降にずれない
+    vc, next_runs = run_scheduler(MONDAY.replace(hour=8), [morning], [jump_now(3), jump_now(-4), until_due])
+    expect(failures, "時計の変更が続く: 実行", vc.applied, [("10-19 09:00", "set", 60)])
+    expect(failures, "時計の変更が続く: 次回", next_runs.get("morning"), "2026-10-20T09:00:00")
+
+def main():
+    failures = []
+    for check in (check_occurrences, check_cap_window, check_open_cap, check_simultaneous, check_clock_jump):
+        before = len(failures)
+        check(failures)
+        print(f"[検証] {check.__name__:<20} {'OK' if len(failures) == before else 'NG'}")
+
+    if failures:
+        print("\n[失敗]")
+        for failure in failures:
+            print(f"  {failure}")
+        return 1
+    print("\n[成功] すべての検証を満たしました")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
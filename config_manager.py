@@ -16,9 +16,14 @@ class ConfigManager:
         self.default_config = {
             "volume_step": 2,
             "notification_duration": 700,
-            "selected_device_id": None
+            "selected_device_id": None,
+            "idle_timeout": 60,  # 秒。無操作がこの時間続くとUIリソースを解放する（0で無効）
+            "volume_rules": [],  # 時刻ベースの音量ルール（volume_scheduler.py参照）
+            "mic_mute_hotkey": "F22",
+            "hotkey_target": "master"  # F23/F24の操作先: "master"（再生デバイス）/ "foreground"（前面アプリ）
         }
         self.config = self.load_config()
+        self._listeners = []
 
     def load_config(self):
         """設定をファイルから読み込む"""
@@ -44,14 +49,39 @@ class ConfigManager:
         except Exception as e:
             print(f"[設定] 設定ファイルの保存エラー: {e}")
 
+    def get_config_dir(self):
+        """設定ファイルを置いているディレクトリを返す（キャッシュ等の保存先）"""
+        return os.path.dirname(os.path.abspath(self.config_file))
+
     def get(self, key, default=None):
         """設定値を取得する"""
         return self.config.get(key, default)
 
     def set(self, key, value):
         """設定値を更新する"""
+        changed = self.config.get(key) != value
         self.config[key] = value
+        if changed:
+            self._notify_listeners({key})
 
     def update(self, updates):
         """複数の設定値を一度に更新する"""
+        changed = {key for key, value in updates.items() if self.config.get(key) != value}
         self.config.update(updates)
+        if changed:
+            self._notify_listeners(changed)
+
+    def add_listener(self, callback):
+        """設定変更時に呼ばれるコールバックを登録する
+
+        Args:
+            callback: 変更されたキーのsetを受け取る関数
+        """
+        self._listeners.append(callback)
+
+    def _notify_listeners(self, changed_keys):
+        for callback in list(self._listeners):
+            try:
+                callback(changed_keys)
+            except Exception as e:
+                print(f"[設定] 変更通知エラー: {e}")
@@ -0,0 +1,306 @@
+"""
+オーディオエンドポイントレジストリモジュール
+
+再生（render）・録音（capture）の両方のエンドポイントを1つのインデックスで管理し、
+アクティベート済みの IAudioEndpointVolume をエンドポイントごとにキャッシュする。
+"""
+import threading
+from ctypes import cast, POINTER
+from comtypes import CLSCTX_ALL, CoCreateInstance, GUID
+from pycaw.pycaw import IAudioEndpointVolume, IMMDeviceEnumerator, EDataFlow, ERole, DEVICE_STATE
+
+RENDER = "render"
+CAPTURE = "capture"
+FLOWS = {
+    RENDER: EDataFlow.eRender.value,
+    CAPTURE: EDataFlow.eCapture.value,
+}
+# データフローの値 -> "render" / "capture"
+FLOW_NAMES = {value: name for name, value in FLOWS.items()}
+
+CLSID_MMDeviceEnumerator = GUID('{BCDE0395-E52F-467C-8E3D-C4579291692E}')
+PKEY_Device_FriendlyName = (GUID('{a45c254e-df1c-4efd-8020-67d146a850e0}'), 14)
+
+def log(message):
+    print(f"🗂️ {message}")
+
+def _flow_from_id(device_id):
+    """未列挙のデバイスIDから方向を推定する（"{0.0.0.…}" は再生、"{0.0.1.…}" は録音）"""
+    if str(device_id).startswith("{0.0.1."):
+        return CAPTURE
+    return RENDER
+
+class EndpointRegistry:
+    def __init__(self):
+        """エンドポイントレジストリを初期化（列挙は最初に必要になった時点で行う）"""
+        self._lock = threading.RLock()
+        # 列挙を1つのスレッドだけで行うためのロック（_lockはCOM呼び出しの間は保持しない）
+        self._refresh_lock = threading.Lock()
+        self.enumerator = CoCreateInstance(CLSID_MMDeviceEnumerator, IMMDeviceEnumerator, CLSCTX_ALL)
+        # デバイスID -> {"id", "name", "flow"}
+        self._endpoints = {}
+        # "render" / "capture" -> デバイスIDのリスト（列挙順）
+        self._by_flow = {RENDER: [], CAPTURE: []}
+        # "render" / "capture" -> 既定デバイスID
+        self._defaults = {RENDER: None, CAPTURE: None}
+        # "render" / "capture" -> 既定デバイスを通知で更新した時点の _changes（列挙結果で上書きしないため）
+        self._default_notified = {RENDER: 0, CAPTURE: 0}
+        # seed()で読み込んだ前回終了時の既定デバイスID（表示専用。最初の列挙で破棄する）
+        self._seeded_defaults = {RENDER: None, CAPTURE: None}
+        # デバイスID -> アクティベート済みの IAudioEndpointVolume
+        self._volume_cache = {}
+        self._dirty = True
+        # デバイス通知を受けるたびに増える（列挙中に届いた通知を取りこぼさないため）
+        self._changes = 0
+        self._listeners = []
+        # 内容が変わるたびに増える（キャッシュの鮮度判定用）
+        self.version = 0
+
+    def add_listener(self, callback):
+        """レジストリの内容が変わったときに呼ばれるコールバックを登録する
+
+        Args:
+            callback: 変更のあった方向（"render" / "capture"）のsetを受け取る関数
+        """
+        self._listeners.append(callback)
+
+    def _notify_listeners(self, flows):
+        if not flows:
+            return
+        for callback in list(self._listeners):
+            try:
+                callback(flows)
+            except Exception as e:
+                log(f"❌ レジストリ変更通知エラー: {e}")
+
+    # --- 列挙 ---
+
+    def refresh(self):
+        """両方向のアクティブなエンドポイントを列挙し直す"""
+        with self._refresh_lock:
+            flows = self._refresh_locked()
+        self._notify_listeners(flows)
+
+    def _refresh_locked(self):
+        """列挙の本体（_refresh_lockを保持した状態で呼ぶ）。内容が変わった方向のsetを返す"""
+        with self._lock:
+            changes = self._changes
+        endpoints = {}
+        by_flow = {RENDER: [], CAPTURE: []}
+        defaults = {RENDER: None, CAPTURE: None}
+        for flow, flow_value in FLOWS.items():
+            try:
+                default_device = self.enumerator.GetDefaultAudioEndpoint(flow_value, ERole.eMultimedia.value)
+                defaults[flow] = default_device.GetId()
+            except Exception:
+                # 録音デバイスが1つもない環境ではここで失敗する
+                defaults[flow] = None
+            try:
+                collection = self.enumerator.EnumAudioEndpoints(flow_value, DEVICE_STATE.ACTIVE.value)
+                for i in range(collection.GetCount()):
+                    device = collection.Item(i)
+                    device_id = device.GetId()
+                    endpoints[device_id] = {
+                        "id": device_id,
+                        "name": self._read_friendly_name(device, flow, i),
+                        "flow": flow,
+                    }
+                    by_flow[flow].append(device_id)
+            except Exception as e:
+                log(f"❌ {flow}デバイス列挙エラー: {e}")
+
+        with self._lock:
+            # 列挙中に通知で更新された既定デバイスは、列挙で得た古い値より新しい
+            for flow in FLOWS:
+                if self._default_notified[flow] > changes:
+                    defaults[flow] = self._defaults[flow]
+            changed_flows = {
+                flow for flow in FLOWS
+                if by_flow[flow] != self._by_flow[flow]
+                or defaults[flow] != self._defaults[flow]
+                or any(endpoints[i]["name"] != self._endpoints.get(i, {}).get("name") for i in by_flow[flow])
+            }
+            self._endpoints = endpoints
+            self._by_flow = by_flow
+            self._defaults = defaults
+            self._seeded_defaults = {RENDER: None, CAPTURE: None}
+            # 消えたエンドポイントのキャッシュは捨てる
+            for device_id in list(self._volume_cache):
+                if device_id not in endpoints:
+                    del self._volume_cache[device_id]
+            # 列挙中にデバイス通知が届いていれば、次回参照時にもう一度列挙する
+            self._dirty = self._changes != changes
+            self.version += 1
+        log(f"✅ エンドポイントを列挙しました (再生: {len(by_flow[RENDER])}個, 録音: {len(by_flow[CAPTURE])}個)")
+        return changed_flows
+
+    def _read_friendly_name(self, device, flow, index):
+        try:
+            prop_store = device.OpenPropertyStore(0)  # STGM_READ
+            prop_value = prop_store.GetValue(PKEY_Device_FriendlyName)
+            return prop_value.value if hasattr(prop_value, 'value') else str(prop_value)
+        except Exception:
+            label = "オーディオデバイス" if flow == RENDER else "録音デバイス"
+            return f"{label} {index + 1}"
+
+    def seed(self, endpoints):
+        """前回終了時のエンドポイント一覧（export()の結果）を読み込む
+
+        列挙済みの扱いにはしないため、list_devices() では通常どおり列挙し直される。
+        それまでの間 peek_devices() で名前と既定デバイスを表示できる。
+        既定デバイスは表示にだけ使い、get_default_id() は前回の値を返さない。
+        """
+        with self._lock:
+            if not self._dirty:
+                return
+            self._endpoints = {}
+            self._by_flow = {RENDER: [], CAPTURE: []}
+            self._seeded_defaults = {RENDER: None, CAPTURE: None}
+            for endpoint in endpoints:
+                if endpoint.get("flow") not in self._by_flow or not endpoint.get("id"):
+                    continue
+                self._endpoints[endpoint["id"]] = {
+                    "id": endpoint["id"],
+                    "name": endpoint.get("name") or endpoint["id"],
+                    "flow": endpoint["flow"],
+                }
+                self._by_flow[endpoint["flow"]].append(endpoint["id"])
+                if endpoint.get("is_default"):
+                    self._seeded_defaults[endpoint["flow"]] = endpoint["id"]
+
+    def export(self):
+        """現在のエンドポイント一覧を返す（seed()に渡せる形式。既定デバイスには "is_default" が付く）"""
+        with self._lock:
+            exported = []
+            for flow in (RENDER, CAPTURE):
+                default_id = self._defaults[flow] or self._seeded_defaults[flow]
+                for device_id in self._by_flow[flow]:
+                    endpoint = dict(self._endpoints[device_id])
+                    if device_id == default_id:
+                        endpoint["is_default"] = True
+                    exported.append(endpoint)
+            return exported
+
+    def peek_devices(self, flow=RENDER):
+        """列挙せずに、手元にあるデバイス一覧を返す（seed()直後は前回終了時の内容）"""
+        with self._lock:
+            default_id = self._defaults[flow] or self._seeded_defaults[flow]
+            return [
+                {
+                    "id": device_id,
+                    "name": self._endpoints[device_id]["name"],
+                    "is_default": device_id == default_id,
+                }
+                for device_id in self._by_flow[flow]
+            ]
+
+    def _ensure_fresh(self):
+        """未列挙・変更ありの場合だけ列挙する。同時に呼ばれても列挙は1回にまとめる"""
+        if not self._dirty:
+            return
+        with self._refresh_lock:
+            # 待っている間に他のスレッドが列挙していれば何もしない
+            if not self._dirty:
+                return
+            flows = self._refresh_locked()
+        self._notify_listeners(flows)
+
+    def list_devices(self, flow=RENDER):
+        """指定方向のデバイス一覧を返す
+
+        Returns:
+            list: [{"id": device_id, "name": device_name, "is_default": bool}, ...]
+        """
+        self._ensure_fresh()
+        return self.peek_devices(flow)
+
+    def get_default_id(self, flow=RENDER):
+        """指定方向の既定デバイスIDを返す
+
+        キャッシュになければ GetDefaultAudioEndpoint だけで求め、全デバイスの列挙はしない。
+        """
+        with self._lock:
+            if not self._dirty or self._defaults[flow] is not None:
+                return self._defaults[flow]
+            changes = self._changes
+        try:
+            device_id = self.enumerator.GetDefaultAudioEndpoint(FLOWS[flow], ERole.eMultimedia.value).GetId()
+        except Exception:
+            # 該当方向のデバイスが1つもない
+            return None
+        with self._lock:
+            # 問い合わせ中に既定デバイスの変更通知が届いていれば、そちらを優先する
+            if self._changes == changes and self._defaults[flow] is None:
+                self._defaults[flow] = device_id
+            return self._defaults[flow]
+
+    def get_endpoint(self, device_id):
+        """デバイスIDからエンドポイント情報を返す（未登録ならNone）"""
+        with self._lock:
+            return self._endpoints.get(device_id)
+
+    # --- 音量インターフェース ---
+
+    def get_endpoint_volume(self, device_id):
+        """エンドポイントの IAudioEndpointVolume を返す。2回目以降はキャッシュを返す"""
+        with self._lock:
+            volume = self._volume_cache.get(device_id)
+            if volume is not None:
+                return volume
+        device = self.enumerator.GetDevice(device_id)
+        interface = device.Activate(IAudioEndpointVolume._iid_, CLSCTX_ALL, None)
+        volume = cast(interface, POINTER(IAudioEndpointVolume))
+        with self._lock:
+            # 同時にアクティベートされた場合は先に登録された方を使う
+            volume = self._volume_cache.setdefault(device_id, volume)
+        log(f"🔌 エンドポイントをアクティベートしました: {device_id}")
+        return volume
+
+    def get_default_volume(self, flow=RENDER):
+        """既定デバイスの IAudioEndpointVolume を返す（既定デバイスがなければNone）"""
+        device_id = self.get_default_id(flow)
+        if device_id is None:
+            return None
+        return self.get_endpoint_volume(device_id)
+
+    # --- デバイス通知からの更新 ---
+
+    def on_default_changed(self, flow_value, role, device_id):
+        """既定デバイスの変更を反映する（列挙はしない）"""
+        flow = FLOW_NAMES.get(flow_value)
+        if flow is None or role != ERole.eMultimedia.value:
+            return
+        with self._lock:
+            self._changes += 1
+            self._default_notified[flow] = self._changes
+            if self._defaults[flow] == device_id:
+                return
+            self._defaults[flow] = device_id
+            self.version += 1
+        self._notify_listeners({flow})
+
+    def on_device_removed(self, device_id):
+        """削除されたデバイスをインデックスとキャッシュから外す"""
+        with self._lock:
+            self._changes += 1
+            self._volume_cache.pop(device_id, None)
+            endpoint = self._endpoints.pop(device_id, None)
+            if endpoint is not None:
+                self._by_flow[endpoint["flow"]].remove(device_id)
+            for flow, default_id in self._defaults.items():
+                if default_id == device_id:
+                    self._defaults[flow] = None
+                    self._default_notified[flow] = self._changes
+                    self._dirty = True
+            self.version += 1
+        self._notify_listeners({endpoint["flow"]} if endpoint is not None else {_flow_from_id(device_id)})
+
+    def on_device_changed(self, device_id):
+        """追加・状態変更されたデバイスがあった場合、次回参照時に列挙し直す"""
+        with self._lock:
+            self._changes += 1
+            self._volume_cache.pop(device_id, None)
+            endpoint = self._endpoints.get(device_id)
+            self._dirty = True
+            self.version += 1
+        self._notify_listeners({endpoint["flow"]} if endpoint is not None else {_flow_from_id(device_id)})
@@ -0,0 +1,140 @@
+"""
+イベントバスモジュール
+
+音声・ホットキー・トレイ・OSDの各層をつなぐプロセス内のPublish/Subscribe。
+購読者ごとに上限付きのキューと配信スレッドを持ち、キューが溢れたら古いイベントを捨てるため、
+遅い購読者（UIなど）が発行側（音声処理）を待たせることはない。
+"""
+import threading
+from collections import deque
+from dataclasses import dataclass
+from typing import Callable, Optional, Tuple, Type
+
+# 購読者ごとのキューの既定サイズ
+DEFAULT_QUEUE_SIZE = 64
+
+def log(message):
+    print(f"📨 {message}")
+
+@dataclass(frozen=True)
+class VolumeChanged:
+    """再生デバイスの音量・ミュート状態が変わった"""
+    volume: int
+    muted: bool
+    device_id: Optional[str] = None
+    # 変更元: "internal"（SoundMaster）/ "external"（他のアプリケーション）
+    source: str = "internal"
+
+@dataclass(frozen=True)
+class SessionVolumeChanged:
+    """アプリケーション（オーディオセッション）の音量が変わった"""
+    volume: int
+    muted: bool
+    process_name: Optional[str] = None
+
+@dataclass(frozen=True)
+class MicMuteChanged:
+    """既定の録音デバイスのミュート状態が変わった"""
+    muted: bool
+    device_id: Optional[str] = None
+
+@dataclass(frozen=True)
+class DeviceChanged:
+    """操作対象の再生デバイスが切り替わった"""
+    device_id: Optional[str]
+
+class Subscription:
+    """購読者1件分のキューと配信スレッド"""
+
+    def __init__(self, name, event_types, callback, maxsize):
+        self.name = name
+        self.event_types = event_types
+        self.callback = callback
+        self._queue = deque(maxlen=maxsize)
+        self._cond = threading.Condition()
+        self._closed = False
+        self.delivered = 0
+        self.dropped = 0
+        self._thread = threading.Thread(target=self._run, name=f"bus-{name}", daemon=True)
+        self._thread.start()
+
+    def accepts(self, event):
+        return not self.event_types or isinstance(event, self.event_types)
+
+    def put(self, event):
+        """イベントを積む。満杯なら最も古いイベントを捨てる（ブロックしない）"""
+        with self._cond:
+            if self._closed:
+                return
+            if len(self._queue) == self._queue.maxlen:
+                self.dropped += 1
+            self._queue.append(event)
+            self._cond.notify()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._queue and not self._closed:
+                    self._cond.wait()
+                if self._closed:
+                    return
+                event = self._queue.popleft()
+            try:
+                self.callback(event)
+                self.delivered += 1
+            except Exception as e:
+                log(f"❌ イベント配信エラー ({self.name}): {e}")
+
+class EventBus:
+    def __init__(self):
+        self._lock = threading.Lock()
+        # publish側はロックを取らずにこのタプルを読む（購読の追加・削除時に差し替える）
+        self._subscriptions: Tuple[Subscription, ...] = ()
+
+    def subscribe(self, name: str, callback: Callable, *event_types: Type, maxsize: int = DEFAULT_QUEUE_SIZE):
+        """イベントを購読する
+
+        Args:
+            name: 購読者名（スレッド名・ログに使う）
+            callback: イベントを受け取る関数（購読者専用のスレッドで呼ばれる）
+            event_types: 受け取るイベントの型（省略時はすべて）
+            maxsize: キューの上限。溢れた場合は古いイベントから捨てる
+
+        Returns:
+            Subscription: unsubscribe に渡す購読情報
+        """
+        subscription = Subscription(name, tuple(event_types), callback, maxsize)
+        with self._lock:
+            self._subscriptions = self._subscriptions + (subscription,)
+        log(f"✅ '{name}' がイベントを購読しました")
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            self._subscriptions = tuple(s for s in self._subscriptions if s is not subscription)
+        subscription.close()
+
+    def publish(self, event):
+        """イベントを発行する。各購読者のキューに積むだけで、配信を待たない"""
+        for subscription in self._subscriptions:
+            if subscription.accepts(event):
+                subscription.put(event)
+
+    def get_stats(self):
+        """購読者ごとの配信数・破棄数を返す"""
+        return {
+            s.name: {"delivered": s.delivered, "dropped": s.dropped, "queued": len(s._queue)}
+            for s in self._subscriptions
+        }
+
+    def close(self):
+        with self._lock:
+            subscriptions = self._subscriptions
+            self._subscriptions = ()
+        for subscription in subscriptions:
+            subscription.close()
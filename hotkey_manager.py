@@ -2,6 +2,9 @@ from pynput import keyboard
 from threading import Thread, Event
 from typing import Callable, Dict, Optional
 
+# F13〜F24の仮想キーコード（pynputがキー名を持たない環境ではvkで判定する）
+FUNCTION_KEY_VKS = {0x7C + i: f"F{13 + i}" for i in range(12)}
+
 def log(message):
     print(f"⌨️ {message}")
 
@@ -21,7 +24,9 @@ class HotkeyManager:
 
         log("▶️ ホットキーリスナーを開始します")
         self._listener = keyboard.Listener(on_press=self._on_key_press)
-        self._thread = Thread(target=self._listener.start, daemon=True)
+        # プロファイラーの出力で識別できるようにスレッド名を付ける
+        self._listener.name = "hotkey-listener"
+        self._thread = Thread(target=self._listener.start, name="hotkey-starter", daemon=True)
         self._thread.start()
         log("✅ ホットキーリスナーが開始されました")
 
@@ -56,27 +61,18 @@ class HotkeyManager:
             # キーの詳細情報をログに出力
             log(f"キーが押されました: {key}")
             
+            key_name = None
             # キー名で判定
             if hasattr(key, 'name'):
-                if key.name == 'f23':
-                    log("🔑 F23キーが押されました")
-                    if 'F23' in self._callbacks:
-                        self._callbacks['F23']()
-                elif key.name == 'f24':
-                    log("🔑 F24キーが押されました")
-                    if 'F24' in self._callbacks:
-                        self._callbacks['F24']()
+                key_name = key.name.upper()
             # 仮想キーコードで判定
             elif hasattr(key, 'vk'):
                 log(f"仮想キーコード: 0x{key.vk:02X}")
-                if key.vk == 0x86:  # F23
-                    log("🔑 F23キーが押されました")
-                    if 'F23' in self._callbacks:
-                        self._callbacks['F23']()
-                elif key.vk == 0x87:  # F24
-                    log("🔑 F24キーが押されました")
-                    if 'F24' in self._callbacks:
-                        self._callbacks['F24']()
+                key_name = FUNCTION_KEY_VKS.get(key.vk)
+
+            if key_name in self._callbacks:
+                log(f"🔑 {key_name}キーが押されました")
+                self._callbacks[key_name]()
         except Exception as e:
             log(f"❌ キー処理中にエラーが発生しました: {e}")
 
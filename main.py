@@ -4,6 +4,12 @@ from volume_control import VolumeControl
 from hotkey_manager import HotkeyManager
 from ui_manager import UIManager
 from config_manager import ConfigManager
+from profiler import Profiler
+from volume_scheduler import VolumeScheduler
+from session_router import SessionRouter
+from state_snapshot import StateSnapshot
+from event_bus import EventBus, VolumeChanged, SessionVolumeChanged, MicMuteChanged, DeviceChanged
+import threading
 import time
 import os
 
@@ -14,34 +20,160 @@ if sys.platform == 'win32':
     sys.stderr = codecs.getwriter('utf-8')(sys.stderr.buffer, 'strict')
     os.system('chcp 65001 > nul')
 
+# 状態の変化からスナップショットを書き出すまでの待ち時間（秒）。この間の変化は1回の書き込みにまとめる
+SNAPSHOT_SAVE_DELAY = 2.0
+
 def log(message):
     print(f"🔍 {message}")
 
 class VolumeControlApp:
     def __init__(self):
         log("🚀 アプリケーションを初期化中...")
+        started = time.perf_counter()
         self.config_manager = ConfigManager()
-        self.volume_control = VolumeControl()
+        # 前回終了時の状態。列挙を待たずにデバイスを選び、UIを表示するために使う
+        self.snapshot = StateSnapshot(self.config_manager.get_config_dir())
+        snapshot = self.snapshot.load()
+        # トレイメニューから有効化するまで何も計測しない
+        self.profiler = Profiler(os.path.join(self.config_manager.get_config_dir(), 'profiles'))
+        # 状態変化は VolumeControl が発行し、OSD・トレイ・ログが購読する
+        self.event_bus = EventBus()
+        # 保存されたデバイスだけをアクティベートする（既定デバイスを経由しない）
+        saved_device_id = self.config_manager.get("selected_device_id")
+        if saved_device_id is None and snapshot is not None:
+            saved_device_id = snapshot["selected_device_id"]
+        device_started = time.perf_counter()
+        self.volume_control = VolumeControl(
+            self.event_bus,
+            device_id=saved_device_id,
+            endpoints=snapshot["endpoints"] if snapshot is not None else None
+        )
+        log(f"⏱️ 音量コントロールの初期化: {(time.perf_counter() - device_started) * 1000:.1f} ms")
         self.ui_manager = UIManager(self.volume_control, parent_app=self)
+        self.ui_manager.subscribe(self.event_bus)
+        self.event_bus.subscribe("log", self._log_event, maxsize=256)
+        # 強制終了やログオフでも直近の状態が残るよう、変化があるたびにスナップショットを保存する
+        self._snapshot_lock = threading.Lock()
+        self._snapshot_timer = None
+        self.event_bus.subscribe(
+            "snapshot", lambda event: self._schedule_snapshot(), VolumeChanged, DeviceChanged, maxsize=1
+        )
+        if self.volume_control.registry is not None:
+            self.volume_control.registry.add_listener(lambda flows: self._schedule_snapshot())
         self.hotkey_manager = HotkeyManager()
+        # F23/F24の操作先を前面アプリケーションにするモード（hotkey_target: "foreground"）
+        self.session_router = SessionRouter(self.volume_control)
 
-        # 保存された音声デバイス設定を適用
-        saved_device_id = self.config_manager.get("selected_device_id")
-        if saved_device_id:
-            log(f"💾 保存された音声デバイス設定を適用します: {saved_device_id}")
-            self.volume_control.set_audio_device(saved_device_id)
+        # トレイアイコンは前回終了時の音量で表示し、実際の値はバックグラウンドで反映する
+        if (snapshot is not None and snapshot["volume"] is not None
+                and snapshot["selected_device_id"] == self.volume_control.device_id):
+            self.ui_manager.update_tray_icon(snapshot["volume"], snapshot["muted"])
+        threading.Thread(target=self._reconcile_startup_state, name="startup-reconcile", daemon=True).start()
 
+        self.setup_scheduler()
+        self.config_manager.add_listener(self._on_config_changed)
+        self._apply_hotkey_target()
         self.setup_hotkeys()
         self.setup_signal_handlers()
+        log(f"⏱️ 起動時間: {(time.perf_counter() - started) * 1000:.1f} ms"
+            f" (スナップショット: {'あり' if snapshot is not None else 'なし'})")
         log("✅ アプリケーションの初期化が完了しました")
         
+    def _reconcile_startup_state(self):
+        """スナップショットで起動した状態を、実際のデバイス一覧・音量と照合する"""
+        import comtypes
+        comtypes.CoInitialize()
+        try:
+            started = time.perf_counter()
+            # 起動時の列挙はここで1回だけ行う（トレイのデバイスメニューはレジストリの変更通知で更新される）
+            devices = self.volume_control.get_audio_devices()
+            default_id = next((device["id"] for device in devices if device["is_default"]), None)
+            device_ids = {device["id"] for device in devices}
+            # デバイスを明示的に選んでいない場合は、既定デバイスに従う
+            if self.volume_control.device_id not in device_ids or (
+                    self.config_manager.get("selected_device_id") is None
+                    and default_id is not None and default_id != self.volume_control.device_id):
+                log(f"🔄 前回のデバイスから既定のデバイスに切り替えます: {default_id}")
+                if default_id is not None:
+                    self.volume_control.set_audio_device(default_id)
+
+            current_volume, is_muted = self.volume_control.batch([("get",), ("is_muted",)])
+            if not isinstance(current_volume, Exception):
+                self.ui_manager.update_tray_icon(current_volume, is_muted)
+            log(f"⏱️ デバイス状態の照合: {(time.perf_counter() - started) * 1000:.1f} ms")
+        except Exception as e:
+            log(f"❌ デバイス状態の照合エラー: {e}")
+        finally:
+            comtypes.CoUninitialize()
+
+    def _schedule_snapshot(self):
+        """スナップショットの保存を予約する（予約済みならその保存に任せる）"""
+        with self._snapshot_lock:
+            if self._snapshot_timer is not None:
+                return
+            self._snapshot_timer = threading.Timer(SNAPSHOT_SAVE_DELAY, self._flush_snapshot)
+            self._snapshot_timer.daemon = True
+            self._snapshot_timer.start()
+
+    def _flush_snapshot(self):
+        with self._snapshot_lock:
+            self._snapshot_timer = None
+        import comtypes
+        comtypes.CoInitialize()
+        try:
+            self._save_snapshot()
+        finally:
+            comtypes.CoUninitialize()
+
+    def _save_snapshot(self):
+        """次回の起動用に現在の状態を保存する"""
+        try:
+            current_volume, is_muted = self.volume_control.batch([("get",), ("is_muted",)])
+            if isinstance(current_volume, Exception):
+                current_volume, is_muted = None, False
+            self.snapshot.save(
+                self.volume_control.device_id,
+                current_volume,
+                bool(is_muted),
+                self.volume_control.registry.export()
+            )
+        except Exception as e:
+            log(f"❌ スナップショットの保存エラー: {e}")
+
     def setup_hotkeys(self):
         log("⌨️ ホットキーを設定中...")
         self.hotkey_manager.register_hotkey('F23', self.volume_down)
         self.hotkey_manager.register_hotkey('F24', self.volume_up)
+        mic_hotkey = self.config_manager.get("mic_mute_hotkey")
+        if mic_hotkey:
+            self.hotkey_manager.register_hotkey(mic_hotkey.upper(), self.toggle_mic_mute)
         self.hotkey_manager.start()
         log("✅ ホットキーの設定が完了しました")
         
+    def setup_scheduler(self):
+        log("⏰ 音量スケジューラを設定中...")
+        self.scheduler = VolumeScheduler(self.volume_control)
+        self.scheduler.update_rules(self.config_manager.get("volume_rules", []))
+        self.scheduler.start()
+        # ルール評価のコストと次回実行時刻は、トレイの「計測値を出力」で確認できる
+        self.profiler.add_metrics_source("scheduler", self.scheduler.get_metrics)
+        self.profiler.add_metrics_source("scheduler_next_runs", self.scheduler.get_next_runs)
+        self.profiler.add_metrics_source("event_bus", self.event_bus.get_stats)
+        log("✅ 音量スケジューラの設定が完了しました")
+
+    def _on_config_changed(self, changed_keys):
+        if "volume_rules" in changed_keys:
+            self.scheduler.update_rules(self.config_manager.get("volume_rules", []))
+        if "hotkey_target" in changed_keys:
+            self._apply_hotkey_target()
+
+    def _apply_hotkey_target(self):
+        """前面アプリケーションモードのときだけ前面ウィンドウを追跡する"""
+        if self.config_manager.get("hotkey_target") == "foreground":
+            self.session_router.start()
+        else:
+            self.session_router.stop()
+
     def setup_signal_handlers(self):
         log("🛡️ シグナルハンドラーを設定中...")
         signal.signal(signal.SIGINT, self.cleanup)
@@ -51,23 +183,48 @@ class VolumeControlApp:
     def volume_up(self):
         log("🔊 音量を上げます")
         try:
-            self.volume_control.volume_up()
-            current_volume = self.volume_control.get_volume()
-            log(f"📊 現在の音量: {current_volume}%")
-            self.ui_manager.show_volume_notification(current_volume, True)
+            # 通知はイベントバス経由でOSD・トレイに届く
+            if not self._adjust_foreground(self.session_router.volume_up):
+                self.volume_control.volume_up()
         except Exception as e:
             log(f"❌ 音量上げエラー: {e}")
         
     def volume_down(self):
         log("🔉 音量を下げます")
         try:
-            self.volume_control.volume_down()
-            current_volume = self.volume_control.get_volume()
-            log(f"📊 現在の音量: {current_volume}%")
-            self.ui_manager.show_volume_notification(current_volume, False)
+            if not self._adjust_foreground(self.session_router.volume_down):
+                self.volume_control.volume_down()
         except Exception as e:
             log(f"❌ 音量下げエラー: {e}")
         
+    def _adjust_foreground(self, operation):
+        """前面アプリケーションモードなら前面アプリの音量を変える。操作できなければFalse（マスター音量を使う）"""
+        if self.config_manager.get("hotkey_target") != "foreground":
+            return False
+        try:
+            return operation() is not None
+        except Exception as e:
+            log(f"⚠️ 前面アプリの音量操作に失敗したため、マスター音量を操作します: {e}")
+            return False
+
+    def toggle_mic_mute(self):
+        log("🎤 マイクのミュートを切り替えます")
+        try:
+            self.volume_control.toggle_mic_mute()
+        except Exception as e:
+            log(f"❌ マイクミュート切り替えエラー: {e}")
+
+    def _log_event(self, event):
+        if isinstance(event, VolumeChanged):
+            origin = "外部" if event.source == "external" else "SoundMaster"
+            log(f"📊 現在の音量: {event.volume}%{' (ミュート)' if event.muted else ''} [{origin}]")
+        elif isinstance(event, SessionVolumeChanged):
+            log(f"🎵 {event.process_name or '前面アプリ'} の音量: {event.volume}%{' (ミュート)' if event.muted else ''}")
+        elif isinstance(event, MicMuteChanged):
+            log(f"🎤 マイク: {'ミュート' if event.muted else 'オン'}")
+        elif isinstance(event, DeviceChanged):
+            log(f"🔄 操作対象デバイス: {event.device_id}")
+
     def run(self):
         log("▶️ アプリケーションを開始します")
         try:
@@ -75,13 +232,24 @@ class VolumeControlApp:
                 time.sleep(0.1)
         except Exception as e:
             log(f"❌ エラーが発生しました: {e}")
-            self.cleanup()
+        # トレイメニューの「終了」でもスナップショットを保存する
+        self.cleanup()
             
     def cleanup(self, *args):
         log("🛑 アプリケーションを終了します")
         self.hotkey_manager.stop()
+        self.session_router.stop()
+        self.scheduler.stop()
+        self.profiler.shutdown()
+        # 予約済みの保存は取り消し、最新の状態をここで書き出す
+        with self._snapshot_lock:
+            if self._snapshot_timer is not None:
+                self._snapshot_timer.cancel()
+                self._snapshot_timer = None
+        self._save_snapshot()
         self.ui_manager.close()
         self.volume_control.cleanup()
+        self.event_bus.close()
         sys.exit(0)
 
 if __name__ == '__main__':
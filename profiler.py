@@ -0,0 +1,272 @@
+"""
+プロファイリングモジュール
+
+実行中のアプリケーションに対して、トレイメニューから必要なときだけ
+CPUサンプリング・メモリスナップショット・スレッドスタック・各モジュールの計測値の出力を行う。
+無効時はスレッドもトレースも動かないため、オーバーヘッドはない。
+"""
+import json
+import os
+import sys
+import threading
+import time
+import traceback
+import tracemalloc
+from collections import Counter
+from datetime import datetime
+
+# CPUサンプリングの間隔（秒）
+DEFAULT_SAMPLE_INTERVAL = 0.005
+# レポートに出力する上位件数
+REPORT_TOP_N = 30
+
+def log(message):
+    print(f"📈 {message}")
+
+class Profiler:
+    def __init__(self, output_dir, interval=DEFAULT_SAMPLE_INTERVAL):
+        """
+        プロファイラーを初期化
+
+        Args:
+            output_dir: 結果ファイルの出力先ディレクトリ
+            interval: CPUサンプリングの間隔（秒）
+        """
+        self.output_dir = output_dir
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._sampler_thread = None
+        self._stop_event = threading.Event()
+        self._samples = Counter()
+        self._sample_count = 0
+        self._sampling_started_at = None
+        self._last_snapshot = None
+        # 名前 -> 計測値（dict）を返す関数
+        self._metrics_sources = {}
+
+    @property
+    def is_sampling(self):
+        return self._sampler_thread is not None
+
+    @property
+    def is_tracing_memory(self):
+        return tracemalloc.is_tracing()
+
+    def _output_path(self, prefix, ext="txt"):
+        os.makedirs(self.output_dir, exist_ok=True)
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+        return os.path.join(self.output_dir, f"{prefix}_{timestamp}.{ext}")
+
+    # --- CPUサンプリング ---
+
+    def toggle_cpu_sampling(self):
+        """CPUサンプリングの開始・停止を切り替える"""
+        if self.is_sampling:
+            return self.stop_cpu_sampling()
+        self.start_cpu_sampling()
+        return None
+
+    def start_cpu_sampling(self):
+        """全スレッドのスタックを一定間隔で採取し始める"""
+        with self._lock:
+            if self._sampler_thread is not None:
+                log("⚠️ CPUサンプリングは既に実行中です")
+                return
+            self._samples = Counter()
+            self._sample_count = 0
+            self._sampling_started_at = time.monotonic()
+            self._stop_event.clear()
+            self._sampler_thread = threading.Thread(
+                target=self._sample_loop, name="profiler-sampler", daemon=True
+            )
+            self._sampler_thread.start()
+        log(f"▶️ CPUサンプリングを開始しました (間隔: {self.interval * 1000:.1f}ms)")
+
+    def stop_cpu_sampling(self):
+        """CPUサンプリングを停止して結果をファイルに書き出す
+
+        Returns:
+            str: レポートファイルのパス（実行中でなかった場合はNone）
+        """
+        with self._lock:
+            thread = self._sampler_thread
+            if thread is None:
+                return None
+            self._stop_event.set()
+        thread.join()
+        with self._lock:
+            self._sampler_thread = None
+            samples = self._samples
+            sample_count = self._sample_count
+            duration = time.monotonic() - self._sampling_started_at
+            self._samples = Counter()
+
+        path = self._output_path("cpu")
+        try:
+            self._write_cpu_report(path, samples, sample_count, duration)
+            log(f"✅ CPUプロファイルを出力しました: {path}")
+        except Exception as e:
+            log(f"❌ CPUプロファイル出力エラー: {e}")
+            return None
+        return path
+
+    def _sample_loop(self):
+        own_ident = threading.get_ident()
+        while not self._stop_event.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own_ident:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                stack.reverse()
+                self._samples[(names.get(ident, str(ident)), tuple(stack))] += 1
+            self._sample_count += 1
+
+    def _write_cpu_report(self, path, samples, sample_count, duration):
+        per_thread = Counter()
+        self_counts = Counter()
+        total_counts = Counter()
+        for (thread_name, stack), count in samples.items():
+            per_thread[thread_name] += count
+            if stack:
+                self_counts[(thread_name, stack[-1])] += count
+            for func in set(stack):
+                total_counts[(thread_name, func)] += count
+
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(f"# CPUプロファイル ({datetime.now().isoformat(timespec='seconds')})\n")
+            f.write(f"計測時間: {duration:.2f}秒 / サンプリング回数: {sample_count}"
+                    f" / 間隔: {self.interval * 1000:.1f}ms\n\n")
+
+            f.write("## スレッド別サンプル数\n")
+            for thread_name, count in per_thread.most_common():
+                f.write(f"{count:8d}  {thread_name}\n")
+
+            f.write(f"\n## 自己時間 上位{REPORT_TOP_N}\n")
+            for (thread_name, func), count in self_counts.most_common(REPORT_TOP_N):
+                f.write(f"{count:8d}  [{thread_name}] {func}\n")
+
+            f.write(f"\n## 累積時間 上位{REPORT_TOP_N}\n")
+            for (thread_name, func), count in total_counts.most_common(REPORT_TOP_N):
+                f.write(f"{count:8d}  [{thread_name}] {func}\n")
+
+            # flamegraph.pl / speedscope で読み込めるcollapsed形式
+            f.write("\n## collapsed stacks\n")
+            for (thread_name, stack), count in samples.most_common():
+                f.write(";".join((thread_name,) + stack) + f" {count}\n")
+
+    # --- メモリスナップショット ---
+
+    def take_memory_snapshot(self):
+        """tracemallocのスナップショットを取得し、前回との差分と合わせて出力する
+
+        初回呼び出し時にトレースを開始するため、差分は2回目以降に出力される。
+
+        Returns:
+            str: レポートファイルのパス
+        """
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(10)
+            log("▶️ メモリトレースを開始しました")
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        ))
+        current, peak = tracemalloc.get_traced_memory()
+
+        path = self._output_path("memory")
+        try:
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(f"# メモリスナップショット ({datetime.now().isoformat(timespec='seconds')})\n")
+                f.write(f"現在: {current / 1024:.1f} KB / ピーク: {peak / 1024:.1f} KB\n")
+
+                f.write(f"\n## 確保量 上位{REPORT_TOP_N}\n")
+                for stat in snapshot.statistics('lineno')[:REPORT_TOP_N]:
+                    f.write(f"{stat}\n")
+
+                if self._last_snapshot is not None:
+                    f.write(f"\n## 前回からの差分 上位{REPORT_TOP_N}\n")
+                    for stat in snapshot.compare_to(self._last_snapshot, 'lineno')[:REPORT_TOP_N]:
+                        f.write(f"{stat}\n")
+            log(f"✅ メモリスナップショットを出力しました: {path}")
+        except Exception as e:
+            log(f"❌ メモリスナップショット出力エラー: {e}")
+            return None
+        finally:
+            self._last_snapshot = snapshot
+        return path
+
+    def stop_memory_tracing(self):
+        """メモリトレースを停止し、保持しているスナップショットを破棄する"""
+        self._last_snapshot = None
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+            log("🛑 メモリトレースを停止しました")
+
+    # --- スレッドスタック ---
+
+    def dump_thread_stacks(self):
+        """全スレッドの現在のスタックを出力する
+
+        Returns:
+            str: 出力ファイルのパス
+        """
+        path = self._output_path("threads")
+        try:
+            threads = {t.ident: t for t in threading.enumerate()}
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(f"# スレッドスタック ({datetime.now().isoformat(timespec='seconds')})\n")
+                for ident, frame in sys._current_frames().items():
+                    thread = threads.get(ident)
+                    name = thread.name if thread else "不明"
+                    daemon = " daemon" if thread and thread.daemon else ""
+                    f.write(f"\n## {name} (ident={ident}{daemon})\n")
+                    f.write("".join(traceback.format_stack(frame)))
+            log(f"✅ スレッドスタックを出力しました: {path}")
+        except Exception as e:
+            log(f"❌ スレッドスタック出力エラー: {e}")
+            return None
+        return path
+
+    # --- 計測値 ---
+
+    def add_metrics_source(self, name, func):
+        """dump_metrics() で出力する計測値の取得関数を登録する
+
+        Args:
+            name: 出力時の見出し
+            func: JSONに変換できる値を返す関数
+        """
+        self._metrics_sources[name] = func
+
+    def dump_metrics(self):
+        """登録された計測値（スケジューラの評価コストなど）をJSONで出力する
+
+        Returns:
+            str: 出力ファイルのパス
+        """
+        metrics = {"time": datetime.now().isoformat(timespec='seconds')}
+        for name, func in self._metrics_sources.items():
+            try:
+                metrics[name] = func()
+            except Exception as e:
+                metrics[name] = {"error": str(e)}
+        path = self._output_path("metrics", "json")
+        try:
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(metrics, f, ensure_ascii=False, indent=2)
+            log(f"✅ 計測値を出力しました: {path}")
+        except Exception as e:
+            log(f"❌ 計測値出力エラー: {e}")
+            return None
+        return path
+
+    def shutdown(self):
+        """実行中の計測をすべて停止する"""
+        if self.is_sampling:
+            self.stop_cpu_sampling()
+        self.stop_memory_tracing()
@@ -0,0 +1,436 @@
+"""
+前面アプリケーションの音量操作モジュール
+
+前面ウィンドウ → プロセス → オーディオセッション の対応をキャッシュし、
+ホットキーで前面アプリケーションの音量を操作する。
+キャッシュは前面ウィンドウの変更通知（SetWinEventHook）と、セッションの作成・終了・切断の通知
+（IAudioSessionNotification / IAudioSessionEvents）で無効化されるため、
+キー入力のたびにセッションを列挙し直すことはない。
+セッション通知はMTAのスレッドでないと届かないため、セッションのCOM操作はすべて
+MTAで初期化した専用スレッド（前面ウィンドウの通知を受けるスレッド）で行う。
+"""
+import ctypes
+import threading
+from collections import OrderedDict
+from queue import Queue, Empty
+from ctypes import wintypes
+import comtypes
+import psutil
+from comtypes import CLSCTX_ALL, COMObject, CoCreateInstance
+from pycaw.pycaw import (
+    IAudioSessionControl2, IAudioSessionEvents, IAudioSessionManager2, IAudioSessionNotification,
+    IMMDeviceEnumerator, ISimpleAudioVolume
+)
+from endpoint_registry import CLSID_MMDeviceEnumerator
+from event_bus import SessionVolumeChanged, DeviceChanged
+from volume_control import EVENT_CONTEXT
+
+EVENT_SYSTEM_FOREGROUND = 0x0003
+WINEVENT_OUTOFCONTEXT = 0x0000
+WINEVENT_SKIPOWNPROCESS = 0x0002
+WM_QUIT = 0x0012
+# 専用スレッドに処理を依頼するメッセージ
+WM_APP_CALL = 0x8000
+PM_NOREMOVE = 0x0000
+# 専用スレッドでの処理を待つ上限（秒）。超えた場合はマスター音量に切り替える
+CALL_TIMEOUT = 1.0
+AUDIO_SESSION_STATE_EXPIRED = 2
+# プロセスID -> (起動時刻, プロセス名) のキャッシュ上限
+PROCESS_CACHE_SIZE = 256
+
+WinEventProcType = ctypes.WINFUNCTYPE(
+    None, wintypes.HANDLE, wintypes.DWORD, wintypes.HWND,
+    wintypes.LONG, wintypes.LONG, wintypes.DWORD, wintypes.DWORD
+)
+
+def log(message):
+    print(f"🎯 {message}")
+
+class SessionCreatedCallback(COMObject):
+    """新しいオーディオセッションの作成通知を受け取るためのクライアント"""
+    _com_interfaces_ = [IAudioSessionNotification]
+
+    def __init__(self, router):
+        super().__init__()
+        self.router = router
+
+    def OnSessionCreated(self, new_session):
+        """セッションが作成されたときに呼ばれる"""
+        self.router.invalidate_sessions()
+        return 0
+
+class SessionEventsCallback(COMObject):
+    """索引に載せたセッションの終了・切断通知を受け取るためのクライアント"""
+    _com_interfaces_ = [IAudioSessionEvents]
+
+    def __init__(self, router):
+        super().__init__()
+        self.router = router
+
+    def OnStateChanged(self, new_state):
+        """セッションの状態が変わったときに呼ばれる"""
+        if new_state == AUDIO_SESSION_STATE_EXPIRED:
+            self.router.invalidate_sessions()
+        return 0
+
+    def OnSessionDisconnected(self, disconnect_reason):
+        """セッションが切断されたとき（デバイス削除など）に呼ばれる"""
+        self.router.invalidate_sessions()
+        return 0
+
+    def OnDisplayNameChanged(self, new_display_name, event_context):
+        return 0
+
+    def OnIconPathChanged(self, new_icon_path, event_context):
+        return 0
+
+    def OnSimpleVolumeChanged(self, new_volume, new_mute, event_context):
+        return 0
+
+    def OnChannelVolumeChanged(self, channel_count, new_channel_volume_array, changed_channel, event_context):
+        return 0
+
+    def OnGroupingParamChanged(self, new_grouping_param, event_context):
+        return 0
+
+class SessionRouter:
+    def __init__(self, volume_control):
+        """
+        前面アプリケーションの音量操作を初期化（start()を呼ぶまで通知は受け取らない）
+
+        Args:
+            volume_control: VolumeControlのインスタンス（操作対象デバイスとイベントバスを共用する）
+        """
+        self.volume_control = volume_control
+        self._lock = threading.Lock()
+        # プロセスID -> (起動時刻, プロセス名)。PIDが再利用されても起動時刻で区別する
+        self._processes = OrderedDict()
+        # プロセスID / プロセス名 -> ISimpleAudioVolume のリスト（Noneは未構築）
+        self._sessions_by_pid = None
+        self._sessions_by_name = None
+        # 索引に載せたセッションと、その終了・切断通知のクライアント
+        self._session_events = []
+        # 前面プロセスと、そのセッションの解決結果（Noneは未解決）
+        self._foreground_pid = None
+        self._foreground_name = None
+        self._foreground_sessions = None
+        # COM通知スレッドからはロックを取らずにフラグだけを立てる（登録解除中の通知と競合しないため）
+        self._index_stale = False
+        self._manager_stale = False
+        # 専用スレッド（MTA）で作ったデバイス列挙子とセッションマネージャー
+        self._enumerator = None
+        self._session_manager = None
+        self._session_manager_device = None
+        self._session_callback = SessionCreatedCallback(self)
+        # 専用スレッドで実行する処理: (関数, 引数, 完了イベント, 結果)
+        self._calls = Queue()
+        self._hook_thread = None
+        self._hook_thread_id = None
+        self._subscription = None
+
+    def start(self):
+        """前面ウィンドウの変更通知とデバイス切り替えの購読を開始する"""
+        if self._hook_thread is not None:
+            return
+        ready = threading.Event()
+        self._hook_thread = threading.Thread(
+            target=self._hook_loop, args=(ready,), name="foreground-hook", daemon=True
+        )
+        self._hook_thread.start()
+        ready.wait(2)
+        if self.volume_control.event_bus is not None:
+            self._subscription = self.volume_control.event_bus.subscribe(
+                "session-router", self._on_device_changed, DeviceChanged
+            )
+        log("▶️ 前面アプリケーションの追跡を開始しました")
+
+    def stop(self):
+        """通知の購読を停止し、キャッシュを破棄する（COMオブジェクトは専用スレッドが解放する）"""
+        if self._hook_thread is None:
+            return
+        if self._subscription is not None:
+            self.volume_control.event_bus.unsubscribe(self._subscription)
+            self._subscription = None
+        if self._hook_thread_id is not None:
+            ctypes.windll.user32.PostThreadMessageW(self._hook_thread_id, WM_QUIT, 0, 0)
+        self._hook_thread.join(2)
+        self._hook_thread = None
+        self._hook_thread_id = None
+        log("🛑 前面アプリケーションの追跡を停止しました")
+
+    # --- 専用スレッド ---
+
+    def _hook_loop(self, ready):
+        """前面ウィンドウの変更通知とセッションのCOM操作を受け持つメッセージループ（専用スレッド）"""
+        user32 = ctypes.windll.user32
+        # IAudioSessionNotification の通知はMTAでないと届かない
+        try:
+            comtypes.CoInitializeEx(comtypes.COINIT_MULTITHREADED)
+        except Exception as e:
+            log(f"❌ COMの初期化エラー: {e}")
+            ready.set()
+            return
+        hook = None
+        try:
+            msg = wintypes.MSG()
+            # PostThreadMessageW を受けられるよう、先にメッセージキューを作る
+            user32.PeekMessageW(ctypes.byref(msg), 0, 0, 0, PM_NOREMOVE)
+            self._hook_thread_id = ctypes.windll.kernel32.GetCurrentThreadId()
+            # コールバックがGCされないよう参照を保持する
+            self._win_event_proc = WinEventProcType(self._on_win_event)
+            hook = user32.SetWinEventHook(
+                EVENT_SYSTEM_FOREGROUND, EVENT_SYSTEM_FOREGROUND, 0, self._win_event_proc,
+                0, 0, WINEVENT_OUTOFCONTEXT | WINEVENT_SKIPOWNPROCESS
+            )
+            if not hook:
+                # 前面ウィンドウは操作のたびに問い合わせる
+                log("❌ 前面ウィンドウの変更通知を登録できませんでした")
+            ready.set()
+            while user32.GetMessageW(ctypes.byref(msg), 0, 0, 0) > 0:
+                if msg.message == WM_APP_CALL and not msg.hWnd:
+                    self._run_calls()
+                    continue
+                user32.TranslateMessage(ctypes.byref(msg))
+                user32.DispatchMessageW(ctypes.byref(msg))
+        finally:
+            if hook:
+                user32.UnhookWinEvent(hook)
+            ready.set()
+            with self._lock:
+                self._release_session_manager_locked()
+                self._enumerator = None
+                self._foreground_pid = None
+                self._processes.clear()
+            # 実行されずに残った依頼は待っている側をすぐに戻す
+            self._run_calls(cancel=True)
+            comtypes.CoUninitialize()
+
+    def _run_calls(self, cancel=False):
+        """依頼された処理を実行する（専用スレッド）"""
+        while True:
+            try:
+                func, args, done, result = self._calls.get_nowait()
+            except Empty:
+                return
+            try:
+                if not cancel:
+                    result["value"] = func(*args)
+            except Exception as e:
+                log(f"❌ セッション操作エラー: {e}")
+            finally:
+                done.set()
+
+    def _call_on_hook_thread(self, func, *args):
+        """func を専用スレッドで実行して結果を返す（スレッドが動いていない・時間切れの場合はNone）"""
+        thread_id = self._hook_thread_id
+        if thread_id is None:
+            return None
+        done = threading.Event()
+        result = {}
+        self._calls.put((func, args, done, result))
+        if not ctypes.windll.user32.PostThreadMessageW(thread_id, WM_APP_CALL, 0, 0):
+            return None
+        if not done.wait(CALL_TIMEOUT):
+            log("⚠️ 前面アプリケーションの音量操作が時間内に終わりませんでした")
+            return None
+        return result.get("value")
+
+    # --- 前面ウィンドウの追跡 ---
+
+    def _on_win_event(self, hook, event, hwnd, id_object, id_child, thread_id, timestamp):
+        """前面ウィンドウが変わったときに呼ばれる"""
+        try:
+            pid = self._pid_for_window(hwnd)
+            with self._lock:
+                # 同じPIDでも別のプロセスの可能性があるため、前面が変わるたびに解決し直す
+                self._foreground_pid = pid
+                self._foreground_sessions = None
+        except Exception as e:
+            log(f"❌ 前面ウィンドウ変更通知エラー: {e}")
+
+    def _pid_for_window(self, hwnd):
+        """ウィンドウを所有するプロセスID（ウィンドウハンドルは再利用されるためキャッシュしない）"""
+        if not hwnd:
+            return None
+        value = wintypes.DWORD()
+        ctypes.windll.user32.GetWindowThreadProcessId(hwnd, ctypes.byref(value))
+        return value.value or None
+
+    def _process_name_locked(self, pid):
+        """プロセス名を返す。PIDの再利用に備えて起動時刻が一致する場合だけキャッシュを使う"""
+        if pid is None:
+            return None
+        try:
+            process = psutil.Process(pid)
+            created = process.create_time()
+        except Exception:
+            self._processes.pop(pid, None)
+            return None
+        entry = self._processes.get(pid)
+        if entry is not None and entry[0] == created:
+            self._processes.move_to_end(pid)
+            return entry[1]
+        try:
+            name = process.name().lower()
+        except Exception:
+            name = None
+        self._processes[pid] = (created, name)
+        if len(self._processes) > PROCESS_CACHE_SIZE:
+            self._processes.popitem(last=False)
+        return name
+
+    # --- セッションの索引 ---
+
+    def invalidate_sessions(self):
+        """セッションの索引を破棄する（次回の操作時に作り直す）。COM通知スレッドから呼ばれる"""
+        self._index_stale = True
+
+    def _on_device_changed(self, event):
+        self._manager_stale = True
+
+    def _drop_index_locked(self):
+        for control, callback in self._session_events:
+            try:
+                control.UnregisterAudioSessionNotification(callback)
+            except Exception as e:
+                log(f"⚠️ セッション通知の登録解除エラー: {e}")
+        self._session_events = []
+        self._sessions_by_pid = None
+        self._sessions_by_name = None
+        self._foreground_sessions = None
+
+    def _release_session_manager_locked(self):
+        self._drop_index_locked()
+        if self._session_manager is not None:
+            try:
+                self._session_manager.UnregisterSessionNotification(self._session_callback)
+            except Exception as e:
+                log(f"⚠️ セッション通知の登録解除エラー: {e}")
+        self._session_manager = None
+        self._session_manager_device = None
+
+    def _get_session_manager_locked(self):
+        device_id = self.volume_control.device_id
+        if self._session_manager is None or self._session_manager_device != device_id:
+            self._release_session_manager_locked()
+            if self._enumerator is None:
+                self._enumerator = CoCreateInstance(CLSID_MMDeviceEnumerator, IMMDeviceEnumerator, CLSCTX_ALL)
+            device = self._enumerator.GetDevice(device_id)
+            interface = device.Activate(IAudioSessionManager2._iid_, CLSCTX_ALL, None)
+            manager = interface.QueryInterface(IAudioSessionManager2)
+            try:
+                manager.RegisterSessionNotification(self._session_callback)
+            except Exception as e:
+                log(f"⚠️ セッション通知の登録エラー: {e}")
+            self._session_manager = manager
+            self._session_manager_device = device_id
+        return self._session_manager
+
+    def _build_index_locked(self):
+        """操作対象デバイス上のセッションを列挙して索引を作る"""
+        self._drop_index_locked()
+        by_pid = {}
+        by_name = {}
+        # セッション作成通知はGetSessionEnumeratorを一度呼んだ後から届く
+        enumerator = self._get_session_manager_locked().GetSessionEnumerator()
+        for i in range(enumerator.GetCount()):
+            control = enumerator.GetSession(i)
+            if control.GetState() == AUDIO_SESSION_STATE_EXPIRED:
+                continue
+            control2 = control.QueryInterface(IAudioSessionControl2)
+            pid = control2.GetProcessId()
+            if not pid:
+                continue  # システム音
+            # セッションが終了・切断されたら索引を作り直す
+            callback = SessionEventsCallback(self)
+            try:
+                control.RegisterAudioSessionNotification(callback)
+                self._session_events.append((control, callback))
+            except Exception as e:
+                log(f"⚠️ セッション通知の登録エラー: {e}")
+            volume = control2.QueryInterface(ISimpleAudioVolume)
+            by_pid.setdefault(pid, []).append(volume)
+            name = self._process_name_locked(pid)
+            if name:
+                by_name.setdefault(name, []).append(volume)
+        self._sessions_by_pid = by_pid
+        self._sessions_by_name = by_name
+        log(f"✅ セッションの索引を作成しました ({len(by_pid)}プロセス)")
+
+    def _resolve_foreground_locked(self):
+        """前面プロセスのセッションを返す（解決済みならキャッシュを返す）"""
+        if self._manager_stale:
+            self._manager_stale = False
+            self._release_session_manager_locked()
+        if self._index_stale:
+            # 作り直しの間に届いた通知で再度無効化されるよう、先にフラグを下ろす
+            self._index_stale = False
+            self._drop_index_locked()
+        if self._foreground_sessions is not None:
+            return self._foreground_sessions
+        pid = self._foreground_pid
+        if pid is None:
+            pid = self._pid_for_window(ctypes.windll.user32.GetForegroundWindow())
+            self._foreground_pid = pid
+        if self._sessions_by_pid is None:
+            self._build_index_locked()
+        sessions = self._sessions_by_pid.get(pid)
+        name = self._process_name_locked(pid)
+        self._foreground_name = name
+        if not sessions:
+            # ブラウザ等は子プロセスが音を出すため、同じ実行ファイル名のセッションも対象にする
+            sessions = self._sessions_by_name.get(name) if name else None
+        self._foreground_sessions = sessions or []
+        return self._foreground_sessions
+
+    # --- 操作 ---
+
+    def adjust(self, delta):
+        """前面アプリケーションの音量を相対的に変更する
+
+        Args:
+            delta: 音量の変化量（%）
+
+        Returns:
+            dict: 変更後の状態 {"volume": int, "muted": bool}。
+                  前面アプリケーションのセッションがない場合はNone（呼び出し側でマスター音量に切り替える）
+        """
+        # ホットキーのスレッドから呼ばれる。セッションのCOMオブジェクトは専用スレッドで作り、使う
+        state = self._call_on_hook_thread(self._adjust_on_hook_thread, delta)
+        if state is None:
+            return None
+        current_volume, new_volume, muted, process_name = state
+        log(f"🎯 {process_name} の音量: {current_volume}% → {new_volume}%")
+        self.volume_control._publish(SessionVolumeChanged(volume=new_volume, muted=muted, process_name=process_name))
+        return {"volume": new_volume, "muted": muted}
+
+    def _adjust_on_hook_thread(self, delta):
+        """adjust() の本体（専用スレッド）。変更前後の音量・ミュート・プロセス名を返す"""
+        with self._lock:
+            for attempt in range(2):
+                try:
+                    sessions = self._resolve_foreground_locked()
+                    if not sessions:
+                        return None
+                    current_volume = round(sessions[0].GetMasterVolume() * 100)
+                    new_volume = max(0, min(100, current_volume + delta))
+                    for session in sessions:
+                        session.SetMasterVolume(new_volume / 100, EVENT_CONTEXT)
+                    muted = bool(sessions[0].GetMute())
+                    process_name = self._foreground_name
+                    break
+                except Exception as e:
+                    # セッションが無効になっていた場合は索引を作り直して1回だけ再試行
+                    log(f"⚠️ セッション操作エラー (試行{attempt + 1}): {e}")
+                    self._drop_index_locked()
+            else:
+                return None
+        return current_volume, new_volume, muted, process_name
+
+    def volume_up(self, step=2):
+        """前面アプリケーションの音量を上げる（セッションがなければNone）"""
+        return self.adjust(step)
+
+    def volume_down(self, step=2):
+        """前面アプリケーションの音量を下げる（セッションがなければNone）"""
+        return self.adjust(-step)
@@ -1,9 +1,12 @@
 """
 設定ウィンドウモジュール
 """
+import threading
 import tkinter as tk
 from tkinter import ttk
 
+LOADING_TEXT = "デバイスを読み込み中..."
+
 class SettingsWindow:
     def __init__(self, parent_app):
         """
@@ -17,8 +20,12 @@ class SettingsWindow:
         self.audio_devices = []
         self.selected_device_id = None
 
-    def show(self):
-        """設定ウィンドウを表示"""
+    def show(self, master=None):
+        """設定ウィンドウを表示（Tkスレッドから呼ぶこと）
+
+        Args:
+            master: 親となるTkルート（UIManagerの通知用ルート）
+        """
         # 既にウィンドウが開いている場合は前面に表示
         if self.window and self.window.winfo_exists():
             self.window.lift()
@@ -26,7 +33,7 @@ class SettingsWindow:
             return
 
         # 新しいウィンドウを作成
-        self.window = tk.Toplevel()
+        self.window = tk.Toplevel(master)
         self.window.title("設定 - SoundMaster")
         self.window.geometry("500x400")
         self.window.resizable(False, False)
@@ -52,48 +59,26 @@ class SettingsWindow:
         device_select_frame.pack(fill=tk.X, pady=5)
         ttk.Label(device_select_frame, text="出力デバイス:", width=15).pack(side=tk.LEFT)
 
-        # デバイス一覧を取得
-        self.audio_devices = self.parent_app.volume_control.get_audio_devices()
-
-        # 保存されたデバイスIDを取得
-        saved_device_id = self.parent_app.config_manager.get("selected_device_id")
-
-        # デバイス名のリストを作成
-        device_names = []
-        selected_index = 0
-        for i, device in enumerate(self.audio_devices):
-            name = device["name"]
-            if device["is_default"]:
-                name += " (デフォルト)"
-                if not saved_device_id:  # 保存されたデバイスIDがない場合はデフォルトを選択
-                    selected_index = i
-            if saved_device_id and device["id"] == saved_device_id:
-                selected_index = i
-            device_names.append(name)
-
-        # コンボボックスを作成
-        self.device_var = tk.StringVar(value=device_names[selected_index] if device_names else "")
-        device_combo = ttk.Combobox(
+        # デバイス一覧は読み込み完了まで仮表示にする
+        self.audio_devices = []
+        self.selected_device_id = self.parent_app.config_manager.get("selected_device_id")
+        self.device_var = tk.StringVar(value=LOADING_TEXT)
+        self.device_combo = ttk.Combobox(
             device_select_frame,
             textvariable=self.device_var,
-            values=device_names,
-            state="readonly",
+            values=[LOADING_TEXT],
+            state="disabled",
             width=40
         )
-        device_combo.pack(side=tk.LEFT, padx=5)
-        device_combo.current(selected_index)
-
-        # 選択されたデバイスのIDを保存
-        if self.audio_devices and len(self.audio_devices) > selected_index:
-            self.selected_device_id = self.audio_devices[selected_index]["id"]
+        self.device_combo.pack(side=tk.LEFT, padx=5)
 
         # デバイス選択時のコールバック
         def on_device_select(event):
-            selected_index = device_combo.current()
+            selected_index = self.device_combo.current()
             if 0 <= selected_index < len(self.audio_devices):
                 self.selected_device_id = self.audio_devices[selected_index]["id"]
 
-        device_combo.bind("<<ComboboxSelected>>", on_device_select)
+        self.device_combo.bind("<<ComboboxSelected>>", on_device_select)
 
         # --- ホットキー設定 ---
         hotkey_frame = ttk.LabelFrame(main_frame, text="ホットキー設定", padding="10")
@@ -111,6 +96,24 @@ class SettingsWindow:
         ttk.Label(f24_frame, text="音量を上げる:", width=15).pack(side=tk.LEFT)
         ttk.Label(f24_frame, text="F24キー", foreground="gray").pack(side=tk.LEFT)
 
+        # マイクミュート
+        mic_hotkey = self.parent_app.config_manager.get("mic_mute_hotkey")
+        if mic_hotkey:
+            mic_frame = ttk.Frame(hotkey_frame)
+            mic_frame.pack(fill=tk.X, pady=5)
+            ttk.Label(mic_frame, text="マイクのミュート:", width=15).pack(side=tk.LEFT)
+            ttk.Label(mic_frame, text=f"{mic_hotkey}キー", foreground="gray").pack(side=tk.LEFT)
+
+        # 操作先（前面アプリケーション / マスター音量）
+        self.foreground_target_var = tk.BooleanVar(
+            value=self.parent_app.config_manager.get("hotkey_target") == "foreground"
+        )
+        ttk.Checkbutton(
+            hotkey_frame,
+            text="前面アプリの音量を操作する（音を出していない場合はマスター音量）",
+            variable=self.foreground_target_var
+        ).pack(anchor=tk.W, pady=5)
+
         # --- 音量調整設定 ---
         volume_frame = ttk.LabelFrame(main_frame, text="音量調整", padding="10")
         volume_frame.pack(fill=tk.X, pady=(0, 15))
@@ -185,6 +188,56 @@ class SettingsWindow:
         self.window.lift()
         self.window.focus_force()
 
+        # デバイス一覧をバックグラウンドで取得
+        window = self.window
+        threading.Thread(
+            target=self._load_devices_worker, args=(window,), name="settings-device-loader", daemon=True
+        ).start()
+
+    def _load_devices_worker(self, window):
+        """デバイス一覧を別スレッドで取得し、結果をTkスレッドへ渡す"""
+        import comtypes
+        comtypes.CoInitialize()
+        try:
+            devices = self.parent_app.volume_control.get_audio_devices()
+        finally:
+            comtypes.CoUninitialize()
+        self.parent_app.ui_manager.run_on_ui_thread(self._populate_devices, window, devices)
+
+    def _populate_devices(self, window, devices):
+        """取得したデバイス一覧をコンボボックスに反映する（Tkスレッド）"""
+        # 読み込み中にウィンドウが閉じられた・開き直された場合は破棄
+        if window is not self.window or not window.winfo_exists():
+            return
+
+        self.audio_devices = devices
+
+        # 保存されたデバイスIDを取得
+        saved_device_id = self.parent_app.config_manager.get("selected_device_id")
+
+        # デバイス名のリストを作成
+        device_names = []
+        selected_index = 0
+        for i, device in enumerate(self.audio_devices):
+            name = device["name"]
+            if device["is_default"]:
+                name += " (デフォルト)"
+                if not saved_device_id:  # 保存されたデバイスIDがない場合はデフォルトを選択
+                    selected_index = i
+            if saved_device_id and device["id"] == saved_device_id:
+                selected_index = i
+            device_names.append(name)
+
+        if not device_names:
+            self.device_var.set("")
+            return
+
+        self.device_combo.config(values=device_names, state="readonly")
+        self.device_combo.current(selected_index)
+
+        # 選択されたデバイスのIDを保存
+        self.selected_device_id = self.audio_devices[selected_index]["id"]
+
     def save_settings(self):
         """設定を保存"""
         volume_step = self.volume_step_var.get()
@@ -193,16 +246,22 @@ class SettingsWindow:
         print(f"[設定] 音量ステップ: {volume_step}%")
         print(f"[設定] 通知表示時間: {notification_duration}ms")
 
-        # 音声デバイスの切り替え
+        # 音声デバイスの切り替え（UIを止めないよう別スレッドで行う）
         if self.selected_device_id:
             print(f"[設定] 音声デバイス: {self.selected_device_id}")
-            self.parent_app.volume_control.set_audio_device(self.selected_device_id)
+            threading.Thread(
+                target=self._switch_device_worker,
+                args=(self.selected_device_id,),
+                name="settings-device-switch",
+                daemon=True
+            ).start()
 
         # 設定をファイルに保存
         self.parent_app.config_manager.update({
             "volume_step": volume_step,
             "notification_duration": notification_duration,
-            "selected_device_id": self.selected_device_id
+            "selected_device_id": self.selected_device_id,
+            "hotkey_target": "foreground" if self.foreground_target_var.get() else "master"
         })
         self.parent_app.config_manager.save_config()
 
@@ -211,3 +270,12 @@ class SettingsWindow:
         # self.parent_app.ui_manager.set_notification_duration(notification_duration)
 
         self.window.destroy()
+
+    def _switch_device_worker(self, device_id):
+        """音声デバイスを別スレッドで切り替える"""
+        import comtypes
+        comtypes.CoInitialize()
+        try:
+            self.parent_app.volume_control.set_audio_device(device_id)
+        finally:
+            comtypes.CoUninitialize()
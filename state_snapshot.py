@@ -0,0 +1,80 @@
+"""
+起動状態スナップショットモジュール
+
+直近のデバイス一覧（既定デバイスを含む）・選択中のデバイス・音量・ミュート状態を
+settings.json の隣に保存し、次回起動時はこれを使って列挙を待たずにUIを表示する。
+強制終了に備えて、状態が変わるたびに（まとめて）保存し、終了時にも保存する。
+内容は起動を速くするためのヒントにすぎず、実際の状態はバックグラウンドの列挙で照合する。
+"""
+import json
+import os
+import threading
+
+SNAPSHOT_FILE = "state_snapshot.json"
+SNAPSHOT_VERSION = 1
+
+def log(message):
+    print(f"💾 {message}")
+
+class StateSnapshot:
+    def __init__(self, config_dir):
+        """
+        スナップショットを初期化
+
+        Args:
+            config_dir: 保存先ディレクトリ（settings.jsonと同じ場所）
+        """
+        self.path = os.path.join(config_dir, SNAPSHOT_FILE)
+        # 実行中の保存と終了時の保存が同じ一時ファイルを使うため直列化する
+        self._save_lock = threading.Lock()
+
+    def load(self):
+        """保存されたスナップショットを読み込む
+
+        Returns:
+            dict: {"selected_device_id", "volume", "muted", "endpoints"}。
+                  ファイルがない・壊れている・形式が古い場合はNone
+        """
+        if not os.path.exists(self.path):
+            return None
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get("version") != SNAPSHOT_VERSION:
+                log("⚠️ スナップショットの形式が異なるため使用しません")
+                return None
+            return {
+                "selected_device_id": data.get("selected_device_id"),
+                "volume": int(data["volume"]) if data.get("volume") is not None else None,
+                "muted": bool(data.get("muted", False)),
+                "endpoints": list(data.get("endpoints") or []),
+            }
+        except Exception as e:
+            log(f"⚠️ スナップショットの読み込みエラー: {e}")
+            return None
+
+    def save(self, selected_device_id, volume, muted, endpoints):
+        """スナップショットを保存する（一時ファイルに書いてから置き換える）
+
+        Args:
+            selected_device_id: 操作対象のデバイスID
+            volume: 音量（%）
+            muted: ミュート状態
+            endpoints: EndpointRegistry.export() の結果
+        """
+        data = {
+            "version": SNAPSHOT_VERSION,
+            "selected_device_id": selected_device_id,
+            "volume": volume,
+            "muted": muted,
+            "endpoints": endpoints,
+        }
+        tmp_path = self.path + ".tmp"
+        try:
+            with self._save_lock:
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump(data, f, ensure_ascii=False, separators=(',', ':'))
+                os.replace(tmp_path, self.path)
+            log(f"✅ スナップショットを保存しました: {self.path}")
+        except Exception as e:
+            log(f"❌ スナップショットの保存エラー: {e}")
@@ -0,0 +1,606 @@
+"""
+VolumeControl の並行実行・障害注入ストレステスト
+
+pycaw / comtypes を障害注入付きの偽バックエンドに差し替えて VolumeControl を構築し、
+多数のスレッドから音量操作・デバイス切り替えを行いながら、
+AudioDeviceNotificationClient のデバイス通知（操作途中のデバイス削除を含む）を発火させる。
+Windows以外（Linux等）でもスレッド周りの変更を検証できる。
+
+検証する不変条件:
+    - 更新の消失がない（読み取りから書き込みまでの間に他スレッドの書き込みが割り込まない）
+    - デッドロックしない（全スレッドが制限時間内に終了する）
+    - ロック保持時間が、保持中に実際に注入された遅延・ハングの合計で説明できる範囲に収まる
+
+使い方:
+    python stress_volume_control.py [--threads 16] [--duration 10] [--seed 1]
+"""
+import argparse
+import codecs
+import contextlib
+import enum
+import os
+import random
+import sys
+import threading
+import time
+import traceback
+import types
+
+# Windows環境で絵文字を表示するためのエンコーディング設定
+if sys.platform == 'win32':
+    sys.stdout = codecs.getwriter('utf-8')(sys.stdout.buffer, 'strict')
+    sys.stderr = codecs.getwriter('utf-8')(sys.stderr.buffer, 'strict')
+
+# ロック保持時間の許容誤差（秒）。スレッド切り替えやログ出力の分
+HOLD_MARGIN = 0.1
+
+class FakeCOMError(OSError):
+    """偽バックエンドが投げるCOMエラー"""
+
+# --- 偽バックエンド ---
+
+class FakeBackend:
+    """障害注入付きの偽オーディオバックエンド"""
+
+    def __init__(self, seed, render_count=3, capture_count=2):
+        self.rng = random.Random(seed)
+        self._state_lock = threading.Lock()
+        self._local = threading.local()
+        self.faults_enabled = False
+        self.latency_max = 0.002
+        self.error_rate = 0.02
+        self.hang_rate = 0.002
+        self.hang_seconds = 0.15
+        self.removal_rate = 0.002
+        self.client = None
+        self.devices = {}
+        self.removed = set()
+        self.defaults = {}
+        for flow, prefix, count in (("render", "spk", render_count), ("capture", "mic", capture_count)):
+            for i in range(count):
+                device_id = f"{{{prefix}-{i}}}"
+                self.devices[device_id] = FakeDevice(self, device_id, flow, f"{prefix.upper()} {i}")
+            self.defaults[flow] = f"{{{prefix}-0}}"
+        self.stats = {"calls": 0, "errors": 0, "hangs": 0, "removals": 0, "lost_updates": 0}
+
+    # 呼び出し回数（スレッドごと）
+    def thread_calls(self):
+        return getattr(self._local, "calls", 0)
+
+    # 注入した遅延・ハングの実測合計（スレッドごと、秒）。ロック保持時間の上限計算に使う
+    def thread_injected(self):
+        return getattr(self._local, "injected", 0.0)
+
+    def _inject_delay(self, seconds):
+        started = time.perf_counter()
+        time.sleep(seconds)
+        self._local.injected = self.thread_injected() + (time.perf_counter() - started)
+
+    def pending_read(self):
+        return getattr(self._local, "read", None)
+
+    def set_pending_read(self, value):
+        self._local.read = value
+
+    def call(self, device=None):
+        """バックエンド呼び出し1回分の遅延・障害を発生させる"""
+        self._local.calls = self.thread_calls() + 1
+        with self._state_lock:
+            self.stats["calls"] += 1
+        if self.faults_enabled:
+            self._inject_delay(self.rng.uniform(0, self.latency_max))
+            r = self.rng.random()
+            if r < self.hang_rate:
+                with self._state_lock:
+                    self.stats["hangs"] += 1
+                self._inject_delay(self.hang_seconds)
+            elif r < self.hang_rate + self.error_rate:
+                with self._state_lock:
+                    self.stats["errors"] += 1
+                self.set_pending_read(None)
+                raise FakeCOMError("E_FAIL (障害注入)")
+            if device is not None and self.rng.random() < self.removal_rate:
+                # 操作の途中で別スレッドからデバイス削除通知を発火させる
+                self.remove_device_async(device.id)
+                self._inject_delay(self.rng.uniform(0, self.latency_max))
+        if device is not None and device.id in self.removed:
+            self.set_pending_read(None)
+            raise FakeCOMError("AUDCLNT_E_DEVICE_INVALIDATED")
+
+    def active_ids(self, flow):
+        with self._state_lock:
+            return [d.id for d in self.devices.values() if d.flow == flow and d.id not in self.removed]
+
+    def remove_device_async(self, device_id):
+        threading.Thread(target=self.remove_device, args=(device_id,), name="fake-removal", daemon=True).start()
+
+    def remove_device(self, device_id):
+        device = self.devices[device_id]
+        with self._state_lock:
+            active = [d for d in self.devices.values() if d.flow == device.flow and d.id not in self.removed]
+            # 最後の1台は削除しない
+            if device_id in self.removed or len(active) <= 1:
+                return
+            self.removed.add(device_id)
+            self.stats["removals"] += 1
+            new_default = None
+            if self.defaults[device.flow] == device_id:
+                new_default = next(d.id for d in active if d.id != device_id)
+                self.defaults[device.flow] = new_default
+        client = self.client
+        if client is None:
+            return
+        client.OnDeviceStateChanged(device_id, 4)  # DEVICE_STATE_NOTPRESENT
+        client.OnDeviceRemoved(device_id)
+        if new_default is not None:
+            self.fire_default_changed(device.flow, new_default)
+
+    def restore_device(self, device_id):
+        with self._state_lock:
+            if device_id not in self.removed:
+                return
+            self.removed.discard(device_id)
+        client = self.client
+        if client is not None:
+            client.OnDeviceAdded(device_id)
+            client.OnDeviceStateChanged(device_id, 1)  # DEVICE_STATE_ACTIVE
+
+    def change_default(self, flow, device_id):
+        with self._state_lock:
+            if device_id in self.removed:
+                return
+            self.defaults[flow] = device_id
+        self.fire_default_changed(flow, device_id)
+
+    def fire_default_changed(self, flow, device_id):
+        client = self.client
+        if client is None:
+            return
+        # Windowsと同様に全ロール分の通知を送る
+        for role in (ERole.eConsole, ERole.eMultimedia, ERole.eCommunications):
+            client.OnDefaultDeviceChanged(EDataFlow[f"e{flow.capitalize()}"].value, role.value, device_id)
+
+class FakeEndpointVolume:
+    """IAudioEndpointVolume の偽実装。更新の消失を検出する"""
+
+    def __init__(self, backend, device):
+        self.backend = backend
+        self.device = device
+        self._lock = threading.Lock()
+        self.level = 0.5
+        self.muted = False
+        self.versions = {"level": 0, "mute": 0}
+
+    def _read(self, kind, value):
+        self.backend.set_pending_read((self.device.id, kind, self.versions[kind]))
+        return value
+
+    def _write(self, kind):
+        # 同じスレッドが直前に読んだ値から他スレッドの書き込みを挟んで書き込んでいないか
+        pending = self.backend.pending_read()
+        if pending is not None and pending[0] == self.device.id and pending[1] == kind:
+            if pending[2] != self.versions[kind]:
+                with self.backend._state_lock:
+                    self.backend.stats["lost_updates"] += 1
+        self.backend.set_pending_read(None)
+        self.versions[kind] += 1
+
+    def GetMasterVolumeLevelScalar(self):
+        self.backend.call(self.device)
+        with self._lock:
+            return self._read("level", self.level)
+
+    def SetMasterVolumeLevelScalar(self, level, context):
+        self.backend.call(self.device)
+        with self._lock:
+            self._write("level")
+            self.level = level
+        return 0
+
+    def RegisterControlChangeNotify(self, callback):
+        self.backend.call(self.device)
+
+    def UnregisterControlChangeNotify(self, callback):
+        self.backend.call(self.device)
+
+    def GetMute(self):
+        self.backend.call(self.device)
+        with self._lock:
+            return self._read("mute", int(self.muted))
+
+    def SetMute(self, muted, context):
+        self.backend.call(self.device)
+        with self._lock:
+            self._write("mute")
+            self.muted = bool(muted)
+        return 0
+
+class FakeDevice:
+    def __init__(self, backend, device_id, flow, name):
+        self.backend = backend
+        self.id = device_id
+        self.flow = flow
+        self.name = name
+        self.endpoint_volume = FakeEndpointVolume(backend, self)
+
+    def GetId(self):
+        return self.id
+
+    def Activate(self, iid, context, params):
+        self.backend.call(self)
+        return self.endpoint_volume
+
+    def OpenPropertyStore(self, mode):
+        self.backend.call(self)
+        return types.SimpleNamespace(GetValue=lambda key: types.SimpleNamespace(value=self.name))
+
+class FakeCollection:
+    def __init__(self, devices):
+        self.devices = devices
+
+    def GetCount(self):
+        return len(self.devices)
+
+    def Item(self, index):
+        return self.devices[index]
+
+class FakeEnumerator:
+    def __init__(self, backend):
+        self.backend = backend
+
+    def GetDefaultAudioEndpoint(self, flow_value, role):
+        self.backend.call()
+        flow = EDataFlow(flow_value).name[1:].lower()
+        return self.backend.devices[self.backend.defaults[flow]]
+
+    def EnumAudioEndpoints(self, flow_value, state_mask):
+        self.backend.call()
+        flow = EDataFlow(flow_value).name[1:].lower()
+        return FakeCollection([self.backend.devices[i] for i in self.backend.active_ids(flow)])
+
+    def GetDevice(self, device_id):
+        self.backend.call()
+        device = self.backend.devices.get(device_id)
+        if device is None or device_id in self.backend.removed:
+            raise FakeCOMError("E_NOTFOUND")
+        return device
+
+    def RegisterEndpointNotificationCallback(self, client):
+        self.backend.client = client
+
+    def UnregisterEndpointNotificationCallback(self, client):
+        self.backend.client = None
+
+class EDataFlow(enum.IntEnum):
+    eRender = 0
+    eCapture = 1
+    eAll = 2
+
+class ERole(enum.IntEnum):
+    eConsole = 0
+    eMultimedia = 1
+    eCommunications = 2
+
+class DEVICE_STATE(enum.IntEnum):
+    ACTIVE = 1
+
+def install_fake_backend(backend):
+    """comtypes / pycaw を偽モジュールに差し替えて volume_control を読み込む"""
+    comtypes = types.ModuleType("comtypes")
+    comtypes.CLSCTX_ALL = 23
+    comtypes.COMObject = type("COMObject", (), {})
+    comtypes.GUID = lambda value: value
+    comtypes.CoCreateInstance = lambda clsid, interface, context: FakeEnumerator(backend)
+    comtypes.CoInitialize = lambda: None
+    comtypes.CoUninitialize = lambda: None
+
+    pycaw = types.ModuleType("pycaw")
+    pycaw_pycaw = types.ModuleType("pycaw.pycaw")
+    pycaw_pycaw.IAudioEndpointVolume = types.SimpleNamespace(_iid_="IAudioEndpointVolume")
+    pycaw_pycaw.IMMDeviceEnumerator = object
+    pycaw_pycaw.IMMNotificationClient = object
+    pycaw_pycaw.EDataFlow = EDataFlow
+    pycaw_pycaw.ERole = ERole
+    pycaw_pycaw.DEVICE_STATE = DEVICE_STATE
+    pycaw.pycaw = pycaw_pycaw
+    pycaw_api = types.ModuleType("pycaw.api")
+    pycaw_endpointvolume = types.ModuleType("pycaw.api.endpointvolume")
+    pycaw_endpointvolume.IAudioEndpointVolumeCallback = object
+    pycaw_api.endpointvolume = pycaw_endpointvolume
+    pycaw.api = pycaw_api
+
+    sys.modules["comtypes"] = comtypes
+    sys.modules["pycaw"] = pycaw
+    sys.modules["pycaw.pycaw"] = pycaw_pycaw
+    sys.modules["pycaw.api"] = pycaw_api
+    sys.modules["pycaw.api.endpointvolume"] = pycaw_endpointvolume
+
+    import endpoint_registry
+    # 偽のインターフェースはctypesのポインタではないのでキャストしない
+    endpoint_registry.cast = lambda obj, typ: obj
+    endpoint_registry.POINTER = lambda typ: typ
+    import volume_control
+    return volume_control
+
+# --- ロック計測 ---
+
+class InstrumentedLock:
+    """待ち時間・保持時間・競合回数を記録するロックのラッパー"""
+
+    def __init__(self, name, inner, backend):
+        self.name = name
+        self._inner = inner
+        self._backend = backend
+        self._owner = None
+        self._depth = 0
+        self._hold_started = 0.0
+        self._calls_started = 0
+        self._injected_started = 0.0
+        self._stats_lock = threading.Lock()
+        self.acquisitions = 0
+        self.contended = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.hold_total = 0.0
+        self.hold_max = 0.0
+        self.violations = []
+
+    def acquire(self, blocking=True, timeout=-1):
+        ident = threading.get_ident()
+        if self._owner == ident:
+            # RLockの再入
+            self._inner.acquire()
+            self._depth += 1
+            return True
+        started = time.perf_counter()
+        acquired = self._inner.acquire(False)
+        contended = not acquired
+        if not acquired:
+            if not blocking:
+                return False
+            acquired = self._inner.acquire(True, timeout)
+            if not acquired:
+                return False
+        wait = time.perf_counter() - started
+        self._owner = ident
+        self._depth = 1
+        self._hold_started = time.perf_counter()
+        self._calls_started = self._backend.thread_calls()
+        self._injected_started = self._backend.thread_injected()
+        with self._stats_lock:
+            self.acquisitions += 1
+            self.contended += contended
+            self.wait_total += wait
+            self.wait_max = max(self.wait_max, wait)
+        return True
+
+    def release(self):
+        if self._depth > 1:
+            self._depth -= 1
+            self._inner.release()
+            return
+        hold = time.perf_counter() - self._hold_started
+        calls = self._backend.thread_calls() - self._calls_started
+        injected = self._backend.thread_injected() - self._injected_started
+        self._owner = None
+        self._depth = 0
+        self._inner.release()
+        # 保持中にこのスレッドへ実際に注入された遅延・ハングの合計が上限
+        bound = injected + HOLD_MARGIN
+        with self._stats_lock:
+            self.hold_total += hold
+            self.hold_max = max(self.hold_max, hold)
+            if hold > bound:
+                self.violations.append((hold, calls, injected))
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+    def report(self):
+        n = max(self.acquisitions, 1)
+        return (f"  {self.name:<14} 取得: {self.acquisitions:7d}  競合: {self.contended:6d}"
+                f" ({self.contended / n * 100:5.1f}%)"
+                f"  待ち 平均/最大: {self.wait_total / n * 1000:7.2f} / {self.wait_max * 1000:7.2f} ms"
+                f"  保持 平均/最大: {self.hold_total / n * 1000:6.2f} / {self.hold_max * 1000:7.2f} ms"
+                f"  上限超過: {len(self.violations)}")
+
+# --- シナリオ ---
+
+def build_volume_control(volume_control_module, backend, event_bus=None):
+    vc = volume_control_module.VolumeControl(event_bus)
+    vc._lock = InstrumentedLock("VolumeControl", vc._lock, backend)
+    vc._mic_lock = InstrumentedLock("mic", vc._mic_lock, backend)
+    vc.registry._lock = InstrumentedLock("registry", vc.registry._lock, backend)
+    return vc
+
+def join_all(threads, timeout):
+    """全スレッドの終了を待ち、終わらなかったスレッドを返す"""
+    deadline = time.monotonic() + timeout
+    for thread in threads:
+        thread.join(max(0, deadline - time.monotonic()))
+    return [thread for thread in threads if thread.is_alive()]
+
+def format_stacks(threads):
+    frames = sys._current_frames()
+    lines = []
+    for thread in threads:
+        frame = frames.get(thread.ident)
+        lines.append(f"--- {thread.name} ---")
+        if frame is not None:
+            lines.append("".join(traceback.format_stack(frame)))
+    return "\n".join(lines)
+
+def run_lost_update_phase(volume_control_module, backend, thread_count, rounds):
+    """障害なし（遅延のみ）で上げ下げを同数行い、最終音量が開始値に戻ることを確認する"""
+    backend.faults_enabled = False
+    vc = build_volume_control(volume_control_module, backend)
+    vc.set_volume(50)
+    # 割り込みが起きやすいよう遅延だけを有効にする
+    rates = (backend.error_rate, backend.hang_rate, backend.removal_rate)
+    backend.error_rate = backend.hang_rate = backend.removal_rate = 0
+    backend.faults_enabled = True
+    barrier = threading.Barrier(thread_count)
+
+    def worker():
+        barrier.wait()
+        for _ in range(rounds):
+            vc.volume_up(1)
+            vc.volume_down(1)
+
+    threads = [threading.Thread(target=worker, name=f"lost-update-{i}", daemon=True) for i in range(thread_count)]
+    for thread in threads:
+        thread.start()
+    stuck = join_all(threads, 30)
+    backend.faults_enabled = False
+    backend.error_rate, backend.hang_rate, backend.removal_rate = rates
+    final = vc.get_volume()
+    return vc, final, stuck
+
+def run_chaos_phase(volume_control_module, backend, thread_count, duration, seed):
+    """障害注入とデバイス通知を行いながら全操作を並行実行する"""
+    from event_bus import EventBus
+    event_bus = EventBus()
+    # 遅いUIを模した購読者。発行側（音声処理）を待たせないことを確認する
+    event_bus.subscribe("slow-ui", lambda event: time.sleep(0.05), maxsize=4)
+    vc = build_volume_control(volume_control_module, backend, event_bus)
+    backend.faults_enabled = True
+    stop = threading.Event()
+    op_stats = {}
+    op_stats_lock = threading.Lock()
+    render_ids = [d.id for d in backend.devices.values() if d.flow == "render"]
+    capture_ids = [d.id for d in backend.devices.values() if d.flow == "capture"]
+
+    operations = [
+        ("volume_up", 6, lambda rng: vc.volume_up(rng.randint(1, 5))),
+        ("volume_down", 6, lambda rng: vc.volume_down(rng.randint(1, 5))),
+        ("toggle_mute", 2, lambda rng: vc.toggle_mute()),
+        ("set_audio_device", 1, lambda rng: vc.set_audio_device(rng.choice(render_ids))),
+        ("toggle_mic_mute", 2, lambda rng: vc.toggle_mic_mute()),
+        ("get_audio_devices", 1, lambda rng: vc.get_audio_devices()),
+        ("batch", 1, lambda rng: vc.batch([("step", rng.randint(-3, 3)), ("get",), ("is_muted",)])),
+    ]
+    weights = [weight for _, weight, _ in operations]
+
+    def worker(index):
+        rng = random.Random(seed * 1000 + index)
+        while not stop.is_set():
+            name, _, func = rng.choices(operations, weights)[0]
+            started = time.perf_counter()
+            error = False
+            try:
+                func(rng)
+            except Exception:
+                error = True
+            elapsed = time.perf_counter() - started
+            with op_stats_lock:
+                s = op_stats.setdefault(name, {"count": 0, "errors": 0, "total": 0.0, "max": 0.0})
+                s["count"] += 1
+                s["errors"] += error
+                s["total"] += elapsed
+                s["max"] = max(s["max"], elapsed)
+
+    def notifier():
+        rng = random.Random(seed)
+        while not stop.wait(rng.uniform(0.005, 0.03)):
+            r = rng.random()
+            if r < 0.3:
+                for device_id in list(backend.removed):
+                    backend.restore_device(device_id)
+            elif r < 0.6:
+                backend.change_default("render", rng.choice(render_ids))
+            elif r < 0.75:
+                backend.change_default("capture", rng.choice(capture_ids))
+            else:
+                backend.remove_device(rng.choice(render_ids + capture_ids))
+
+    threads = [threading.Thread(target=worker, args=(i,), name=f"worker-{i}", daemon=True)
+               for i in range(thread_count)]
+    threads.append(threading.Thread(target=notifier, name="notifier", daemon=True))
+    for thread in threads:
+        thread.start()
+    time.sleep(duration)
+    stop.set()
+    # 最悪でもハング数回分で全スレッドが止まるはず
+    stuck = join_all(threads, 10 + backend.hang_seconds * 10)
+    backend.faults_enabled = False
+    op_stats["(event bus)"] = event_bus.get_stats()
+    event_bus.close()
+    return vc, op_stats, stuck
+
+@contextlib.contextmanager
+def quiet_logs(verbose):
+    """アプリケーションのログ出力を抑制する"""
+    if verbose:
+        yield
+        return
+    with open(os.devnull, 'w', encoding='utf-8') as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+def main():
+    parser = argparse.ArgumentParser(description="VolumeControlの並行実行・障害注入ストレステスト")
+    parser.add_argument("--threads", type=int, default=16, help="操作スレッド数")
+    parser.add_argument("--duration", type=float, default=10.0, help="障害注入フェーズの秒数")
+    parser.add_argument("--rounds", type=int, default=5, help="更新消失フェーズでの1スレッドあたりの上げ下げ回数")
+    parser.add_argument("--seed", type=int, default=1, help="乱数シード")
+    parser.add_argument("--error-rate", type=float, default=0.02, help="バックエンド呼び出しが失敗する確率")
+    parser.add_argument("--hang-rate", type=float, default=0.002, help="バックエンド呼び出しがハングする確率")
+    parser.add_argument("--removal-rate", type=float, default=0.002, help="操作途中にデバイスが削除される確率")
+    parser.add_argument("--verbose", action="store_true", help="アプリケーションのログも表示する")
+    args = parser.parse_args()
+
+    backend = FakeBackend(args.seed)
+    backend.error_rate = args.error_rate
+    backend.hang_rate = args.hang_rate
+    backend.removal_rate = args.removal_rate
+    volume_control_module = install_fake_backend(backend)
+
+    failures = []
+
+    print(f"[ストレス] 更新消失フェーズ: {args.threads}スレッド x {args.rounds}往復")
+    with quiet_logs(args.verbose):
+        vc, final, stuck = run_lost_update_phase(volume_control_module, backend, args.threads, args.rounds)
+    if stuck:
+        failures.append("更新消失フェーズでデッドロック:\n" + format_stacks(stuck))
+    if final != 50:
+        failures.append(f"更新消失: 最終音量 {final}% (期待値 50%)")
+    print(f"  最終音量: {final}% / 検出した更新消失: {backend.stats['lost_updates']}")
+    for lock in (vc._lock, vc._mic_lock, vc.registry._lock):
+        print(lock.report())
+
+    print(f"\n[ストレス] 障害注入フェーズ: {args.threads}スレッド x {args.duration}秒"
+          f" (失敗率 {args.error_rate}, ハング率 {args.hang_rate}, 削除率 {args.removal_rate})")
+    with quiet_logs(args.verbose):
+        vc, op_stats, stuck = run_chaos_phase(volume_control_module, backend, args.threads, args.duration, args.seed)
+    if stuck:
+        failures.append("障害注入フェーズでデッドロック:\n" + format_stacks(stuck))
+
+    bus_stats = op_stats.pop("(event bus)")
+    print("  操作別:")
+    for name, s in sorted(op_stats.items()):
+        print(f"    {name:<18} 回数: {s['count']:7d}  例外: {s['errors']:5d}"
+              f"  平均: {s['total'] / max(s['count'], 1) * 1000:7.2f} ms  最大: {s['max'] * 1000:8.2f} ms")
+    print("  ロック:")
+    for lock in (vc._lock, vc._mic_lock, vc.registry._lock):
+        print(lock.report())
+        for hold, calls, injected in lock.violations[:5]:
+            failures.append(f"{lock.name}: 保持時間 {hold * 1000:.1f} ms が上限を超過"
+                            f" (バックエンド呼び出し {calls}回, 注入した遅延 {injected * 1000:.1f} ms)")
+    print(f"  バックエンド: {backend.stats}")
+    print(f"  イベントバス: {bus_stats}")
+    if backend.stats["lost_updates"]:
+        failures.append(f"更新消失を {backend.stats['lost_updates']} 回検出しました")
+
+    if failures:
+        print("\n[失敗]")
+        for failure in failures:
+            print(f"  {failure}")
+        return 1
+    print("\n[成功] すべての不変条件を満たしました")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
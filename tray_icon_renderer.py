@@ -0,0 +1,199 @@
+"""
+トレイアイコン描画モジュール
+
+ベースアイコンから音量レベル別・ミュート用のトレイアイコンを事前描画し、
+メモリとディスクにキャッシュする。
+"""
+import hashlib
+import os
+import sys
+import threading
+from collections import deque
+from PIL import Image, ImageDraw
+
+# 描画内容を変更したときはこの値を上げてディスクキャッシュを無効化する
+RENDER_VERSION = 1
+# 音量アイコンの刻み幅（%）
+VOLUME_BUCKET_STEP = 5
+MUTED_KEY = "muted"
+
+def log(message):
+    print(f"🖼️ {message}")
+
+def get_tray_icon_size():
+    """現在のDPIに合ったトレイアイコンのサイズ（ピクセル）を取得する"""
+    if sys.platform == 'win32':
+        try:
+            import ctypes
+            user32 = ctypes.windll.user32
+            SM_CXSMICON = 49
+            try:
+                dpi = user32.GetDpiForSystem()
+                size = user32.GetSystemMetricsForDpi(SM_CXSMICON, dpi)
+            except AttributeError:
+                # Windows 10 1607より前はDPI指定版がない
+                size = user32.GetSystemMetrics(SM_CXSMICON)
+            if size > 0:
+                return size
+        except Exception as e:
+            log(f"⚠️ アイコンサイズ取得エラー: {e}")
+    return 32
+
+class TrayIconRenderer:
+    def __init__(self, base_icon_path, cache_dir, size=None, on_ready=None):
+        """
+        トレイアイコンレンダラーを初期化
+
+        Args:
+            base_icon_path: ベースとなるアイコン画像のパス
+            cache_dir: ディスクキャッシュを置くディレクトリ
+            size: アイコンサイズ（Noneの場合はDPIから決定）
+            on_ready: アイコンが1つ描画されるたびに呼ばれるコールバック（引数はキー）
+        """
+        self.base_icon_path = base_icon_path
+        self.size = size or get_tray_icon_size()
+        self.on_ready = on_ready
+        self.artwork_hash = self._hash_artwork()
+        # アートワークのハッシュとサイズごとにキャッシュを分ける
+        self.cache_dir = os.path.join(
+            cache_dir, f"{self.artwork_hash[:16]}_{self.size}px_v{RENDER_VERSION}"
+        )
+        self._images = {}
+        self._base_image = None
+        self._pending = deque()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @staticmethod
+    def all_keys():
+        """描画対象のすべてのキーを返す"""
+        keys = list(range(0, 101, VOLUME_BUCKET_STEP))
+        keys.append(MUTED_KEY)
+        return keys
+
+    @staticmethod
+    def bucket_key(volume_level, is_muted=False):
+        """音量とミュート状態からキャッシュキーを求める"""
+        if is_muted:
+            return MUTED_KEY
+        volume_level = max(0, min(100, int(volume_level)))
+        return int(round(volume_level / VOLUME_BUCKET_STEP)) * VOLUME_BUCKET_STEP
+
+    def start(self):
+        """バックグラウンドでの事前描画を開始する"""
+        with self._lock:
+            for key in self.all_keys():
+                if key not in self._images and key not in self._pending:
+                    self._pending.append(key)
+            self._ensure_thread_locked()
+        log(f"▶️ トレイアイコンの事前描画を開始します ({self.size}px)")
+
+    def _ensure_thread_locked(self):
+        """描画スレッドが停止していれば起動する（_lockを保持した状態で呼ぶ）"""
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._build_loop, name="tray-icon-renderer", daemon=True
+            )
+            self._thread.start()
+
+    def get(self, key):
+        """キャッシュ済みのアイコンを返す。未描画の場合は優先的に描画を依頼してNoneを返す"""
+        image = self._images.get(key)
+        if image is not None:
+            return image
+        with self._lock:
+            if key in self._images:
+                return self._images[key]
+            # 要求されたキーを先頭に回す
+            try:
+                self._pending.remove(key)
+            except ValueError:
+                pass
+            self._pending.appendleft(key)
+            self._ensure_thread_locked()
+        return None
+
+    def _hash_artwork(self):
+        h = hashlib.sha256()
+        with open(self.base_icon_path, 'rb') as f:
+            h.update(f.read())
+        return h.hexdigest()
+
+    def _cache_path(self, key):
+        name = MUTED_KEY if key == MUTED_KEY else f"vol_{key:03d}"
+        return os.path.join(self.cache_dir, f"{name}.png")
+
+    def _build_loop(self):
+        while True:
+            with self._lock:
+                if not self._pending:
+                    # 描画待ちがなくなったらスレッドを終了する（次の要求で再起動）
+                    self._thread = None
+                    self._base_image = None
+                    log("✅ トレイアイコンの事前描画が完了しました")
+                    return
+                key = self._pending.popleft()
+                if key in self._images:
+                    continue
+            try:
+                image = self._load_or_render(key)
+            except Exception as e:
+                log(f"❌ アイコン描画エラー ({key}): {e}")
+                continue
+            with self._lock:
+                self._images[key] = image
+            if self.on_ready:
+                try:
+                    self.on_ready(key)
+                except Exception as e:
+                    log(f"❌ アイコン更新コールバックエラー: {e}")
+
+    def _load_or_render(self, key):
+        path = self._cache_path(key)
+        if os.path.exists(path):
+            try:
+                image = Image.open(path)
+                image.load()
+                return image
+            except Exception as e:
+                log(f"⚠️ キャッシュ読み込みエラー ({path}): {e}")
+        image = self._render(key)
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            image.save(path, format='PNG')
+        except Exception as e:
+            log(f"⚠️ キャッシュ保存エラー ({path}): {e}")
+        return image
+
+    def _get_base_image(self):
+        if self._base_image is None:
+            img = Image.open(self.base_icon_path)
+            if img.mode != 'RGBA':
+                img = img.convert('RGBA')
+            self._base_image = img.resize((self.size, self.size), Image.Resampling.LANCZOS)
+        return self._base_image
+
+    def _render(self, key):
+        """ベースアイコンに音量バーまたはミュート表示を重ねて描画する"""
+        image = self._get_base_image().copy()
+        draw = ImageDraw.Draw(image)
+        s = self.size
+        bar_height = max(2, s // 6)
+        top = s - bar_height
+        if key == MUTED_KEY:
+            # 赤い斜線でミュートを表す
+            width = max(2, s // 8)
+            draw.line([(1, 1), (s - 2, s - 2)], fill=(230, 40, 40, 255), width=width)
+            draw.rectangle([0, top, s - 1, s - 1], fill=(35, 35, 35, 230))
+        else:
+            draw.rectangle([0, top, s - 1, s - 1], fill=(35, 35, 35, 230))
+            filled = round((s - 2) * key / 100)
+            if filled > 0:
+                draw.rectangle([1, top + 1, filled, s - 2], fill=(255, 255, 255, 255))
+        return image
+
+    def clear_memory_cache(self):
+        """メモリ上のキャッシュを破棄する（ディスクキャッシュは残す）"""
+        with self._lock:
+            self._images.clear()
+            self._base_image = None
@@ -1,6 +1,8 @@
 import pystray
+import gc
 import threading
 import time
+import weakref
 from PIL import Image
 import os
 from volume_control import VolumeControl
@@ -8,6 +10,14 @@ import tkinter as tk
 from tkinter import ttk
 from queue import Queue, Empty
 from settings_window import SettingsWindow
+from tray_icon_renderer import TrayIconRenderer
+from endpoint_registry import RENDER
+from event_bus import VolumeChanged, SessionVolumeChanged, MicMuteChanged, DeviceChanged
+
+# キー押しっぱなし時のトレイアイコン差し替え間隔の下限（秒）
+TRAY_ICON_MIN_INTERVAL = 0.15
+# 省メモリモードに入るまでの無操作時間（秒）
+DEFAULT_IDLE_TIMEOUT = 60
 
 class UIManager:
     def __init__(self, volume_control: VolumeControl, parent_app=None):
@@ -18,41 +28,217 @@ class UIManager:
         self.icon_path = os.path.join(base_path, 'resources', 'app_icon.ico')
         self.icon = Image.open(self.icon_path)
 
-        # 設定ウィンドウのインスタンス
-        self.settings_window = SettingsWindow(parent_app)
+        # 音量レベル別トレイアイコンの事前描画
+        if parent_app is not None:
+            config_dir = parent_app.config_manager.get_config_dir()
+        else:
+            config_dir = base_path
+        self.icon_renderer = TrayIconRenderer(
+            self.icon_path,
+            os.path.join(config_dir, 'icon_cache'),
+            on_ready=self._on_tray_icon_ready
+        )
+        self._tray_icon_lock = threading.Lock()
+        self._tray_icon_timer = None
+        self._pending_icon_key = None
+        self._current_icon_key = None
+        self._last_icon_swap = 0.0
+
+        # 設定ウィンドウのインスタンス（必要になった時点で生成する）
+        self.settings_window = None
+
+        # 一定時間操作がなければTkやキャッシュを解放する（0で無効）
+        if parent_app is not None:
+            self.idle_timeout = parent_app.config_manager.get("idle_timeout", DEFAULT_IDLE_TIMEOUT)
+        else:
+            self.idle_timeout = DEFAULT_IDLE_TIMEOUT
+        self._last_ui_activity = time.monotonic()
+        self._ui_state_lock = threading.Lock()
+
+        # 出力デバイスのサブメニュー項目（デバイスの増減があったときだけ別スレッドで作り直す）
+        self._device_menu_lock = threading.Lock()
+        self._device_menu_items = (pystray.MenuItem('読み込み中...', None, enabled=False),)
+        self._device_menu_dirty = False
+        self._device_menu_thread = None
 
-        self.menu = pystray.Menu(
-            pystray.MenuItem('設定', self.open_settings),
+        menu_items = [pystray.MenuItem('設定', self.open_settings)]
+        if volume_control is not None and volume_control.registry is not None:
+            # メニューを開くたびには列挙せず、作成済みの項目を返す
+            menu_items.append(pystray.MenuItem('出力デバイス', pystray.Menu(lambda: self._device_menu_items)))
+        profiler = getattr(parent_app, 'profiler', None)
+        if profiler is not None:
+            menu_items.append(pystray.MenuItem('プロファイリング', self._create_profiler_menu(profiler)))
+        menu_items += [
             pystray.Menu.SEPARATOR,
             pystray.MenuItem('終了', self.stop)
-        )
+        ]
+        self.menu = pystray.Menu(*menu_items)
         self.tray = pystray.Icon('volume_control', self.icon, '音量コントロール', self.menu)
-        threading.Thread(target=self.tray.run, daemon=True).start()
+        threading.Thread(target=self.tray.run, name="tray", daemon=True).start()
+        self.icon_renderer.start()
+        if volume_control is not None and volume_control.registry is not None:
+            volume_control.registry.add_listener(self._on_registry_changed)
+            # 前回終了時の一覧があればそれを表示し、列挙は起動時の照合（main.py）に任せる。
+            # 内容が変わっていればレジストリの変更通知で作り直される
+            cached_devices = volume_control.registry.peek_devices()
+            if cached_devices:
+                self._set_device_menu_items(cached_devices)
+            else:
+                self._invalidate_device_menu()
         # 通知UI用のキューとスレッド
         self._notify_queue = Queue()
-        self._ui_thread = threading.Thread(target=self._notification_ui_loop, daemon=True)
+        # Tkスレッドで実行する処理のキュー（Tkは単一スレッドからのみ操作する）
+        self._ui_call_queue = Queue()
+        self._root = None
+        self._ui_thread = None
+        with self._ui_state_lock:
+            self._start_ui_thread_locked()
+
+    def _start_ui_thread_locked(self):
+        """Tkスレッドを起動する（_ui_state_lockを保持した状態で呼ぶ）"""
+        self._ui_thread = threading.Thread(target=self._notification_ui_loop, name="osd-ui", daemon=True)
         self._ui_thread.start()
 
-    def show_volume_notification(self, volume_level: int, is_up: bool):
-        self._notify_queue.put(volume_level)
+    def _post_to_ui(self, queue, item):
+        """Tkスレッド向けのキューに積む。省メモリモード中ならTkを再構築する"""
+        with self._ui_state_lock:
+            queue.put(item)
+            if self._ui_thread is None:
+                print("[UI] 省メモリモードから復帰します")
+                self._start_ui_thread_locked()
+
+    @property
+    def is_idle(self):
+        """省メモリモード中（Tkスレッドが停止している）かどうか"""
+        return self._ui_thread is None
+
+    def subscribe(self, event_bus):
+        """イベントバスの状態変化をOSDとトレイアイコンに反映する"""
+        event_bus.subscribe("osd", self._on_osd_event, VolumeChanged, SessionVolumeChanged, MicMuteChanged, maxsize=4)
+        event_bus.subscribe("tray", self._on_tray_event, VolumeChanged, maxsize=4)
+        # 操作対象が変わったらチェックマークだけ付け直す（列挙はしない）
+        event_bus.subscribe("device-menu", lambda event: self.tray.update_menu(), DeviceChanged, maxsize=1)
+
+    def _on_osd_event(self, event):
+        if isinstance(event, MicMuteChanged):
+            self.show_mic_notification(event.muted)
+        elif isinstance(event, SessionVolumeChanged):
+            # トレイアイコンはマスター音量を表すため、前面アプリの音量はOSDだけに出す
+            self._post_to_ui(self._notify_queue, ("🎵", f"{event.volume}%", event.volume))
+        else:
+            self._show_volume_osd(event.volume, event.muted)
+
+    def _on_tray_event(self, event):
+        self.update_tray_icon(event.volume, event.muted)
+
+    def _show_volume_osd(self, volume_level: int, is_muted: bool):
+        self._post_to_ui(self._notify_queue, ("🔇" if is_muted else "🔊", f"{volume_level}%", volume_level))
+
+    def show_mic_notification(self, is_muted: bool):
+        """マイクのミュート状態を通知する（バーは表示しない）"""
+        self._post_to_ui(self._notify_queue, ("🎤", "ミュート" if is_muted else "オン", None))
+
+    def update_tray_icon(self, volume_level: int, is_muted: bool = False):
+        """トレイアイコンを音量に合わせて差し替える（描画は行わずキャッシュ済み画像を渡す）
+
+        pystrayのwin32実装は icon の代入ごとに画像を一時.icoファイルへ書き出して LoadImage するため、
+        差し替え自体のコストは残る。TRAY_ICON_MIN_INTERVAL で差し替えの頻度を抑えている。
+        """
+        key = self.icon_renderer.bucket_key(volume_level, is_muted)
+        with self._tray_icon_lock:
+            self._pending_icon_key = key
+            if self._tray_icon_timer is not None:
+                # 予約済みの差し替えが最新の状態を反映する
+                return
+            delay = self._last_icon_swap + TRAY_ICON_MIN_INTERVAL - time.monotonic()
+            if delay > 0:
+                self._tray_icon_timer = threading.Timer(delay, self._flush_tray_icon)
+                self._tray_icon_timer.daemon = True
+                self._tray_icon_timer.start()
+                return
+        self._flush_tray_icon()
+
+    def _flush_tray_icon(self):
+        with self._tray_icon_lock:
+            self._tray_icon_timer = None
+            key = self._pending_icon_key
+            if key is None or key == self._current_icon_key:
+                return
+            image = self.icon_renderer.get(key)
+            if image is None:
+                # 描画完了時に_on_tray_icon_readyから再試行される
+                return
+            self._current_icon_key = key
+            self._last_icon_swap = time.monotonic()
+        try:
+            self.tray.icon = image
+        except Exception as e:
+            print(f"[UI] トレイアイコン更新エラー: {e}")
+
+    def _on_tray_icon_ready(self, key):
+        """事前描画スレッドから呼ばれる。待っていたアイコンが描画されたら差し替える"""
+        with self._tray_icon_lock:
+            if key != self._pending_icon_key or self._tray_icon_timer is not None:
+                return
+        self._flush_tray_icon()
+
+    def run_on_ui_thread(self, func, *args):
+        """任意の処理をTkスレッドで実行するよう予約する（どのスレッドからでも呼べる）"""
+        self._post_to_ui(self._ui_call_queue, (func, args))
+
+    def _try_enter_idle(self):
+        """無操作が続いていれば省メモリモードに入る（Tkスレッド）
+
+        Returns:
+            bool: 省メモリモードに入った場合True（呼び出し側でTkルートを破棄する）
+        """
+        if not self.idle_timeout or self.idle_timeout <= 0:
+            return False
+        if time.monotonic() - self._last_ui_activity < self.idle_timeout:
+            return False
+        if self._current_window is not None and self._current_window.winfo_exists():
+            return False
+        settings = self.settings_window
+        if settings is not None and settings.window is not None and settings.window.winfo_exists():
+            return False
+        with self._ui_state_lock:
+            if not self._notify_queue.empty() or not self._ui_call_queue.empty():
+                return False
+            # 再生成可能なリソースへの参照を手放す
+            self._root = None
+            self._current_window = None
+            self._close_timer = None
+            self.settings_window = None
+            self.icon_renderer.clear_memory_cache()
+            # ここで None にした後に積まれた要求は新しいTkスレッドが処理する
+            self._ui_thread = None
+            return True
 
     def _notification_ui_loop(self):
         root = tk.Tk()
         root.withdraw()
+        self._root = root
         self._current_window = None
         self._close_timer = None
-        def show_notification(volume_level):
+        self._last_ui_activity = time.monotonic()
+        def show_notification(icon_text, text, bar_value):
             accent_color = '#ffffff'
             bg_color = '#232323'
+            # バーのない通知（マイク等）は文字が長いため小さめに表示する
+            text_font = ("Segoe UI", 44 if bar_value is not None else 30, "bold")
             def close_and_reset():
                 if self._current_window is not None and self._current_window.winfo_exists():
                     self._current_window.destroy()
                 self._current_window = None
             if self._current_window is not None and self._current_window.winfo_exists():
-                self._current_window.percent_label.config(text=f"{volume_level}%", fg=accent_color)
-                self._current_window.icon_label.config(text="🔊", fg=accent_color)
+                self._current_window.percent_label.config(text=text, font=text_font, fg=accent_color)
+                self._current_window.icon_label.config(text=icon_text, fg=accent_color)
                 if hasattr(self._current_window, 'bar'):
-                    self._current_window.bar['value'] = volume_level
+                    if bar_value is None:
+                        self._current_window.bar.place_forget()
+                    else:
+                        self._current_window.bar.place(relx=0.5, rely=0.85, anchor='center')
+                        self._current_window.bar['value'] = bar_value
                 if self._close_timer is not None:
                     self._current_window.after_cancel(self._close_timer)
                 self._close_timer = self._current_window.after(700, close_and_reset)
@@ -70,12 +256,12 @@ class UIManager:
                 y = (screen_height - window_height) // 2
                 win.geometry(f"{window_width}x{window_height}+{x}+{y}")
                 win.configure(bg=bg_color)
-                icon_label = tk.Label(win, text="🔊", font=("Segoe UI Emoji", 40), fg=accent_color, bg=bg_color)
+                icon_label = tk.Label(win, text=icon_text, font=("Segoe UI Emoji", 40), fg=accent_color, bg=bg_color)
                 icon_label.place(relx=0.5, rely=0.18, anchor='center')
                 percent_label = tk.Label(
                     win,
-                    text=f"{volume_level}%",
-                    font=("Segoe UI", 44, "bold"),
+                    text=text,
+                    font=text_font,
                     fg=accent_color,
                     bg=bg_color
                 )
@@ -84,8 +270,9 @@ class UIManager:
                 style.theme_use('clam')
                 style.configure("Custom.Horizontal.TProgressbar", troughcolor=bg_color, bordercolor=bg_color, background=accent_color, lightcolor=accent_color, darkcolor=accent_color, thickness=12)
                 bar = ttk.Progressbar(win, orient="horizontal", length=160, mode="determinate", maximum=100, style="Custom.Horizontal.TProgressbar")
-                bar.place(relx=0.5, rely=0.85, anchor='center')
-                bar['value'] = volume_level
+                if bar_value is not None:
+                    bar.place(relx=0.5, rely=0.85, anchor='center')
+                    bar['value'] = bar_value
                 win.percent_label = percent_label
                 win.icon_label = icon_label
                 win.bar = bar
@@ -95,17 +282,138 @@ class UIManager:
         def poll_queue():
             try:
                 while True:
-                    volume_level = self._notify_queue.get_nowait()
-                    show_notification(volume_level)
+                    item = self._notify_queue.get_nowait()
+                    self._last_ui_activity = time.monotonic()
+                    show_notification(*item)
             except Empty:
                 pass
+            try:
+                while True:
+                    func, args = self._ui_call_queue.get_nowait()
+                    self._last_ui_activity = time.monotonic()
+                    try:
+                        func(*args)
+                    except Exception as e:
+                        print(f"[UI] UIスレッド処理エラー: {e}")
+            except Empty:
+                pass
+            if self._try_enter_idle():
+                root.destroy()
+                return
             root.after(50, poll_queue)
         poll_queue()
         root.mainloop()
+        # 省メモリモードに入った: poll_queue は自身を参照する循環を作り root も保持しているため、
+        # ここで参照を断ってこのスレッドで回収する（別スレッドのGCでTkappが解放されると
+        # Tcl_AsyncDelete で異常終了する）
+        root_ref = weakref.ref(root)
+        root = None
+        poll_queue = None
+        show_notification = None
+        gc.collect()
+        if root_ref() is not None:
+            print("[UI] ⚠️ Tkルートが解放されませんでした")
+        print("[UI] 省メモリモードに入りました")
+
+    def _create_profiler_menu(self, profiler):
+        """プロファイリング用のサブメニューを作成する"""
+        def run_in_background(func):
+            # ファイル出力でトレイのスレッドを止めないよう別スレッドで実行する。
+            # クリック直後のメニュー更新は処理の完了前に走るため、完了後にもう一度更新する
+            def worker():
+                try:
+                    func()
+                finally:
+                    self.tray.update_menu()
+            return lambda: threading.Thread(target=worker, name="profiler-action", daemon=True).start()
+        return pystray.Menu(
+            pystray.MenuItem(
+                'CPUサンプリング',
+                run_in_background(profiler.toggle_cpu_sampling),
+                checked=lambda item: profiler.is_sampling
+            ),
+            pystray.MenuItem('メモリスナップショット', run_in_background(profiler.take_memory_snapshot)),
+            pystray.MenuItem(
+                'メモリトレースを停止',
+                run_in_background(profiler.stop_memory_tracing),
+                enabled=lambda item: profiler.is_tracing_memory
+            ),
+            pystray.MenuItem('スレッドスタックを出力', run_in_background(profiler.dump_thread_stacks)),
+            pystray.MenuItem('計測値を出力', run_in_background(profiler.dump_metrics))
+        )
+
+    def _on_registry_changed(self, flows):
+        # 録音デバイスだけの変更ではサブメニューを作り直さない
+        if RENDER in flows:
+            self._invalidate_device_menu()
+
+    def _invalidate_device_menu(self):
+        """デバイス一覧が変わったときに呼ばれ、サブメニューを別スレッドで作り直す"""
+        with self._device_menu_lock:
+            self._device_menu_dirty = True
+            if self._device_menu_thread is not None:
+                # 作り直し中のスレッドがもう一度作り直す
+                return
+            self._device_menu_thread = threading.Thread(
+                target=self._rebuild_device_menu, name="device-menu", daemon=True
+            )
+            self._device_menu_thread.start()
+
+    def _rebuild_device_menu(self):
+        import comtypes
+        comtypes.CoInitialize()
+        try:
+            while True:
+                with self._device_menu_lock:
+                    if not self._device_menu_dirty:
+                        self._device_menu_thread = None
+                        return
+                    self._device_menu_dirty = False
+                self._set_device_menu_items(self.volume_control.get_audio_devices())
+        except Exception as e:
+            print(f"[UI] デバイスメニューの作成エラー: {e}")
+            with self._device_menu_lock:
+                self._device_menu_thread = None
+        finally:
+            comtypes.CoUninitialize()
+
+    def _set_device_menu_items(self, devices):
+        self._device_menu_items = tuple(
+            pystray.MenuItem(
+                device["name"],
+                self._create_device_action(device["id"]),
+                checked=lambda item, device_id=device["id"]: device_id == self.volume_control.device_id,
+                radio=True
+            )
+            for device in devices
+        ) or (pystray.MenuItem('デバイスがありません', None, enabled=False),)
+        self.tray.update_menu()
+
+    def _create_device_action(self, device_id):
+        """デバイス切り替えのメニュー動作を作る（トレイのスレッドを止めないよう別スレッドで切り替える）"""
+        return lambda: threading.Thread(
+            target=self._switch_device_worker, args=(device_id,), name="tray-device-switch", daemon=True
+        ).start()
+
+    def _switch_device_worker(self, device_id):
+        import comtypes
+        comtypes.CoInitialize()
+        try:
+            self.volume_control.set_audio_device(device_id)
+            if self.parent_app is not None:
+                self.parent_app.config_manager.set("selected_device_id", device_id)
+                self.parent_app.config_manager.save_config()
+        finally:
+            comtypes.CoUninitialize()
 
     def open_settings(self):
-        """設定ウィンドウを開く"""
-        self.settings_window.show()
+        """設定ウィンドウを開く（トレイメニューのスレッドから呼ばれるためTkスレッドへ転送する）"""
+        self.run_on_ui_thread(self._show_settings)
+
+    def _show_settings(self):
+        if self.settings_window is None:
+            self.settings_window = SettingsWindow(self.parent_app)
+        self.settings_window.show(self._root)
 
     def stop(self):
         self.is_running = False
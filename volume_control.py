@@ -1,8 +1,13 @@
-from ctypes import cast, POINTER
-from comtypes import CLSCTX_ALL, COMObject
-from pycaw.pycaw import AudioUtilities, IAudioEndpointVolume, IMMDeviceEnumerator, IMMNotificationClient, EDataFlow, ERole
+from comtypes import COMObject, GUID
+from pycaw.pycaw import IMMNotificationClient, EDataFlow, ERole
+from pycaw.api.endpointvolume import IAudioEndpointVolumeCallback
 import sys
 import threading
+from endpoint_registry import EndpointRegistry, RENDER, CAPTURE
+from event_bus import VolumeChanged, MicMuteChanged, DeviceChanged
+
+# SoundMaster自身による変更であることを示すイベントコンテキスト（音量変更通知で自分の変更を除外する）
+EVENT_CONTEXT = GUID('{5E0C7F4B-2B9A-4D61-9C3E-8A1F6B2D7C40}')
 
 def log(message):
     print(f"🔊 {message}")
@@ -19,6 +24,7 @@ class AudioDeviceNotificationClient(COMObject):
     def OnDefaultDeviceChanged(self, flow, role, device_id):
         """デフォルトデバイスが変更されたときに呼ばれる"""
         try:
+            self.volume_control.registry.on_default_changed(flow, role, device_id)
             if flow == EDataFlow.eRender.value:  # 再生デバイスの場合のみ
                 log(f"🔄 デフォルト再生デバイスが変更されました: {device_id}")
                 self.volume_control._reinitialize_device()
@@ -28,30 +34,80 @@ class AudioDeviceNotificationClient(COMObject):
     def OnDeviceAdded(self, device_id):
         """デバイスが追加されたときに呼ばれる"""
         log(f"➕ デバイスが追加されました: {device_id}")
+        self.volume_control.registry.on_device_changed(device_id)
 
     def OnDeviceRemoved(self, device_id):
         """デバイスが削除されたときに呼ばれる"""
         log(f"➖ デバイスが削除されました: {device_id}")
+        self.volume_control.registry.on_device_removed(device_id)
 
     def OnDeviceStateChanged(self, device_id, new_state):
         """デバイスの状態が変更されたときに呼ばれる"""
         log(f"🔄 デバイスの状態が変更されました: {device_id}, 新しい状態: {new_state}")
+        self.volume_control.registry.on_device_changed(device_id)
 
     def OnPropertyValueChanged(self, device_id, key):
         """デバイスのプロパティが変更されたときに呼ばれる"""
         pass  # 必要に応じて実装
 
+class AudioVolumeChangeCallback(COMObject):
+    """音量・ミュートの変更通知を受け取るためのコールバック（他アプリによる変更の検出用）"""
+    _com_interfaces_ = [IAudioEndpointVolumeCallback]
+
+    def __init__(self, volume_control_instance):
+        super().__init__()
+        self.volume_control = volume_control_instance
+
+    def OnNotify(self, pNotify):
+        """音量またはミュート状態が変更されたときに呼ばれる"""
+        try:
+            data = pNotify.contents
+            # SoundMaster自身の変更は発行済みなので無視する
+            if data.guidEventContext == EVENT_CONTEXT:
+                return 0
+            self.volume_control._publish(VolumeChanged(
+                volume=round(data.fMasterVolume * 100),
+                muted=bool(data.bMuted),
+                device_id=self.volume_control.device_id,
+                source="external"
+            ))
+        except Exception as e:
+            log(f"❌ 音量変更通知エラー: {e}")
+        return 0
+
 class VolumeControl:
-    def __init__(self):
+    def __init__(self, event_bus=None, device_id=None, endpoints=None):
+        """
+        音量コントロールを初期化
+
+        Args:
+            event_bus: 状態変化を発行するEventBus（Noneの場合は発行しない）
+            device_id: 最初に操作対象にするデバイスID（Noneの場合は既定の再生デバイス）
+            endpoints: 前回終了時のエンドポイント一覧（EndpointRegistry.seed()に渡す）
+        """
         log("音量コントロールを初期化中...")
+        self.event_bus = event_bus
         self._lock = threading.Lock()
+        # マイクはスピーカーとは別のロックで操作する
+        self._mic_lock = threading.Lock()
         self.volume = None
+        self.device_id = None
+        # スケジューラの cap ルールなどによる音量の上限（%）
+        self._volume_limit = 100
+        self.registry = None
         self.device_enumerator = None
         self.notification_client = None
+        self.volume_callback = None
 
         try:
-            # デバイスの初期化
-            self._initialize_device()
+            # 再生・録音エンドポイントのレジストリ
+            self.registry = EndpointRegistry()
+            if endpoints:
+                self.registry.seed(endpoints)
+            self.volume_callback = AudioVolumeChangeCallback(self)
+
+            # デバイスの初期化（保存されたデバイスがあれば、既定デバイスを経由せずに直接アクティベートする）
+            self._initialize_device(device_id)
 
             # デバイス変更通知の登録
             self._register_device_notifications()
@@ -61,32 +117,65 @@ class VolumeControl:
             log(f"❌ 初期化エラー: {e}")
             sys.exit(1)
 
-    def _initialize_device(self):
-        """デバイスを初期化する"""
+    def _initialize_device(self, device_id=None):
+        """デバイスを初期化する
+
+        Args:
+            device_id: 操作対象にするデバイスID。Noneまたはアクティベートできない場合は既定の再生デバイス
+        """
+        if device_id is not None:
+            try:
+                log(f"スピーカーデバイス（保存済み）: {device_id}")
+                self._attach_device(device_id)
+                log("✅ デバイスの初期化が完了しました")
+                return
+            except Exception as e:
+                log(f"⚠️ 保存されたデバイスを使用できません。既定のデバイスを使用します: {e}")
         try:
-            devices = AudioUtilities.GetSpeakers()
-            log(f"スピーカーデバイス: {devices}")
-            interface = devices.Activate(IAudioEndpointVolume._iid_, CLSCTX_ALL, None)
-            self.volume = cast(interface, POINTER(IAudioEndpointVolume))
+            device_id = self.registry.get_default_id(RENDER)
+            log(f"スピーカーデバイス: {device_id}")
+            self._attach_device(device_id)
             log("✅ デバイスの初期化が完了しました")
         except Exception as e:
             log(f"❌ デバイス初期化エラー: {e}")
             raise
 
+    def _attach_device(self, device_id):
+        """操作対象のデバイスを切り替え、音量変更通知の登録先も移す（ロック内で呼ぶ）"""
+        volume = self.registry.get_endpoint_volume(device_id)
+        if volume is self.volume:
+            return
+        if self.volume is not None:
+            try:
+                self.volume.UnregisterControlChangeNotify(self.volume_callback)
+            except Exception as e:
+                log(f"⚠️ 音量変更通知の登録解除エラー: {e}")
+        self.volume = volume
+        self.device_id = device_id
+        try:
+            volume.RegisterControlChangeNotify(self.volume_callback)
+        except Exception as e:
+            log(f"⚠️ 音量変更通知の登録エラー: {e}")
+        self._publish(DeviceChanged(device_id))
+
+    def _publish(self, event):
+        """イベントバスに状態変化を発行する（配信は待たない）"""
+        if self.event_bus is not None:
+            self.event_bus.publish(event)
+
+    def _publish_volume(self, volume, muted=None):
+        """音量の変更を発行する（ロック内で呼ぶ）"""
+        if self.event_bus is None:
+            return
+        if muted is None:
+            muted = self._is_muted_unsafe()
+        self._publish(VolumeChanged(volume=volume, muted=muted, device_id=self.device_id))
+
     def _register_device_notifications(self):
         """デバイス変更通知を登録する"""
         try:
-            from comtypes import CoCreateInstance, GUID
-
-            # CLSID_MMDeviceEnumeratorを直接定義
-            CLSID_MMDeviceEnumerator = GUID('{BCDE0395-E52F-467C-8E3D-C4579291692E}')
-
-            # デバイス列挙子を取得
-            self.device_enumerator = CoCreateInstance(
-                CLSID_MMDeviceEnumerator,
-                IMMDeviceEnumerator,
-                CLSCTX_ALL
-            )
+            # レジストリのデバイス列挙子を共用する
+            self.device_enumerator = self.registry.enumerator
 
             # 通知クライアントを作成して登録
             self.notification_client = AudioDeviceNotificationClient(self)
@@ -131,31 +220,145 @@ class VolumeControl:
                 if self.volume is None:
                     log("⚠️ デバイスが初期化されていません")
                     return
-                volume_level = max(0, min(100, volume_level))
+                volume_level = max(0, min(self._volume_limit, volume_level))
                 log(f"🔊 音量を {volume_level}% に設定します")
-                result = self.volume.SetMasterVolumeLevelScalar(volume_level / 100, None)
+                result = self.volume.SetMasterVolumeLevelScalar(volume_level / 100, EVENT_CONTEXT)
                 log(f"✅ 音量の設定が完了しました (結果: {result})")
+                self._publish_volume(volume_level)
             except Exception as e:
                 log(f"❌ 音量設定エラー: {e}")
         
+    def _get_volume_unsafe(self):
+        """ロックなしで音量を取得（内部使用専用）"""
+        return round(self.volume.GetMasterVolumeLevelScalar() * 100)
+
+    def _set_volume_unsafe(self, volume_level):
+        """ロックなしで音量を設定（内部使用専用）。上限を適用し、設定後の音量を返す"""
+        volume_level = max(0, min(self._volume_limit, volume_level))
+        self.volume.SetMasterVolumeLevelScalar(volume_level / 100, EVENT_CONTEXT)
+        return volume_level
+
+    def set_volume_limit(self, limit):
+        """音量の上限を設定する。以降の set_volume / adjust / batch は上限を超えない
+
+        Args:
+            limit: 上限（%）。Noneで解除
+        """
+        with self._lock:
+            self._volume_limit = 100 if limit is None else max(0, min(100, int(limit)))
+
+    def adjust(self, delta):
+        """音量を相対的に変更する（取得から設定までを1回のロックで行う）
+
+        Args:
+            delta: 音量の変化量（%）。負の値で下げる
+
+        Returns:
+            dict: 変更後の状態 {"volume": int, "muted": bool}
+        """
+        with self._lock:
+            try:
+                if self.volume is None:
+                    log("⚠️ デバイスが初期化されていません")
+                    return {"volume": 0, "muted": False}
+                current_volume = self._get_volume_unsafe()
+                new_volume = self._set_volume_unsafe(current_volume + delta)
+                log(f"🔊 音量を変更しました: {current_volume}% → {new_volume}%")
+                state = {"volume": new_volume, "muted": self._is_muted_unsafe()}
+                self._publish_volume(state["volume"], state["muted"])
+                return state
+            except Exception as e:
+                log(f"❌ 音量変更エラー: {e}")
+                return {"volume": 0, "muted": False}
+
+    def batch(self, operations):
+        """複数の操作を1回のロック取得でまとめて実行する
+
+        Args:
+            operations: 操作のリスト。各要素は次のいずれかのタプル
+                ("get",)             現在の音量を返す
+                ("set", volume)      音量を設定し、設定後の音量を返す
+                ("step", delta)      音量を相対変更し、変更後の音量を返す
+                ("cap", volume)      音量が上限を超えていれば下げ、変更後の音量を返す
+                ("mute", state)      ミュート状態を設定し、設定後の状態を返す
+                ("toggle_mute",)     ミュートを切り替え、切り替え後の状態を返す
+                ("is_muted",)        ミュート状態を返す
+
+        Returns:
+            list: 各操作の結果。失敗した操作の結果は例外オブジェクトになる
+        """
+        results = []
+        with self._lock:
+            if self.volume is None:
+                log("⚠️ デバイスが初期化されていません")
+                error = RuntimeError("デバイスが初期化されていません")
+                return [error for _ in operations]
+            # 変更があった場合に最後の状態を1回だけ発行する
+            changed = False
+            volume = muted = None
+            for op in operations:
+                name, args = op[0], op[1:]
+                try:
+                    if name == "get":
+                        volume = self._get_volume_unsafe()
+                        results.append(volume)
+                    elif name == "set":
+                        volume = self._set_volume_unsafe(args[0])
+                        changed = True
+                        results.append(volume)
+                    elif name == "step":
+                        volume = self._set_volume_unsafe(self._get_volume_unsafe() + args[0])
+                        changed = True
+                        results.append(volume)
+                    elif name == "cap":
+                        volume = self._get_volume_unsafe()
+                        if volume > args[0]:
+                            volume = self._set_volume_unsafe(args[0])
+                            changed = True
+                        results.append(volume)
+                    elif name == "mute":
+                        muted = bool(args[0])
+                        self.volume.SetMute(muted, EVENT_CONTEXT)
+                        changed = True
+                        results.append(muted)
+                    elif name == "toggle_mute":
+                        muted = not self._is_muted_unsafe()
+                        self.volume.SetMute(muted, EVENT_CONTEXT)
+                        changed = True
+                        results.append(muted)
+                    elif name == "is_muted":
+                        muted = self._is_muted_unsafe()
+                        results.append(muted)
+                    else:
+                        raise ValueError(f"不明な操作: {name}")
+                except Exception as e:
+                    log(f"❌ 一括操作エラー ({name}): {e}")
+                    results.append(e)
+            if changed and self.event_bus is not None:
+                try:
+                    if volume is None:
+                        volume = self._get_volume_unsafe()
+                    self._publish_volume(volume, muted)
+                except Exception as e:
+                    log(f"❌ 状態発行エラー: {e}")
+        return results
+
     def volume_up(self, step=2):
-        try:
-            current_volume = self.get_volume()
-            new_volume = current_volume + step
-            log(f"🔊 音量を上げます: {current_volume}% → {new_volume}%")
-            self.set_volume(new_volume)
-        except Exception as e:
-            log(f"❌ 音量上げエラー: {e}")
-        
+        """音量を上げる
+
+        Returns:
+            dict: 変更後の状態 {"volume": int, "muted": bool}
+        """
+        return self.adjust(step)
+
     def volume_down(self, step=2):
-        try:
-            current_volume = self.get_volume()
-            new_volume = current_volume - step
-            log(f"🔊 音量を下げます: {current_volume}% → {new_volume}%")
-            self.set_volume(new_volume)
-        except Exception as e:
-            log(f"❌ 音量下げエラー: {e}")
-        
+        """音量を下げる
+
+        Returns:
+            dict: 変更後の状態 {"volume": int, "muted": bool}
+        """
+        return self.adjust(-step)
+
     def toggle_mute(self):
         with self._lock:
             try:
@@ -164,8 +367,10 @@ class VolumeControl:
                     return
                 is_muted = self._is_muted_unsafe()
                 log(f"🔇 ミュートを切り替えます: {'ミュート解除' if is_muted else 'ミュート'}")
-                result = self.volume.SetMute(not is_muted, None)
+                result = self.volume.SetMute(not is_muted, EVENT_CONTEXT)
                 log(f"✅ ミュート切り替え完了 (結果: {result})")
+                if self.event_bus is not None:
+                    self._publish_volume(self._get_volume_unsafe(), not is_muted)
             except Exception as e:
                 log(f"❌ ミュート切り替えエラー: {e}")
 
@@ -190,8 +395,10 @@ class VolumeControl:
                     log("⚠️ デバイスが初期化されていません")
                     return
                 log(f"🔇 ミュートを {'有効' if mute_state else '無効'} に設定します")
-                result = self.volume.SetMute(mute_state, None)
+                result = self.volume.SetMute(mute_state, EVENT_CONTEXT)
                 log(f"✅ ミュート設定完了 (結果: {result})")
+                if self.event_bus is not None:
+                    self._publish_volume(self._get_volume_unsafe(), bool(mute_state))
             except Exception as e:
                 log(f"❌ ミュート設定エラー: {e}")
 
@@ -203,71 +410,20 @@ class VolumeControl:
         """
         devices = []
         try:
-            from comtypes import CoCreateInstance, GUID
-            from pycaw.pycaw import EDataFlow, ERole, DEVICE_STATE
-
-            # CLSID_MMDeviceEnumeratorを直接定義
-            CLSID_MMDeviceEnumerator = GUID('{BCDE0395-E52F-467C-8E3D-C4579291692E}')
-
-            # デバイス列挙子を取得
-            device_enum = CoCreateInstance(
-                CLSID_MMDeviceEnumerator,
-                IMMDeviceEnumerator,
-                CLSCTX_ALL
-            )
-
-            # デフォルトデバイスを取得
-            default_device = device_enum.GetDefaultAudioEndpoint(EDataFlow.eRender.value, ERole.eMultimedia.value)
-            default_device_id = default_device.GetId()
-
-            # すべてのアクティブな再生デバイスを列挙
-            collection = device_enum.EnumAudioEndpoints(EDataFlow.eRender.value, DEVICE_STATE.ACTIVE.value)
-            count = collection.GetCount()
-
-            for i in range(count):
-                device = collection.Item(i)
-                device_id = device.GetId()
-
-                # デバイス名を取得
-                from pycaw.pycaw import IPropertyStore
-                from comtypes import GUID
-                import ctypes
-
-                prop_store = device.OpenPropertyStore(0)  # STGM_READ
-
-                # PKEY_Device_FriendlyName
-                PKEY_Device_FriendlyName = (GUID('{a45c254e-df1c-4efd-8020-67d146a850e0}'), 14)
-
-                try:
-                    prop_value = prop_store.GetValue(PKEY_Device_FriendlyName)
-                    device_name = prop_value.value if hasattr(prop_value, 'value') else str(prop_value)
-                except:
-                    device_name = f"オーディオデバイス {i+1}"
-
-                is_default = (device_id == default_device_id)
-
-                devices.append({
-                    "id": device_id,
-                    "name": device_name,
-                    "is_default": is_default
-                })
-
-                log(f"{'🔊' if is_default else '🔈'} デバイス検出: {device_name}")
-
+            # デバイス通知で変更があったときだけ列挙し直される
+            devices = self.registry.list_devices(RENDER)
+            for device in devices:
+                log(f"{'🔊' if device['is_default'] else '🔈'} デバイス検出: {device['name']}")
             log(f"✅ {len(devices)}個のオーディオデバイスが見つかりました")
 
         except Exception as e:
             log(f"❌ デバイス一覧取得エラー: {e}")
             # エラーが発生した場合は、少なくとも現在のデフォルトデバイスを返す
-            try:
-                default_device = AudioUtilities.GetSpeakers()
-                devices.append({
-                    "id": "default",
-                    "name": "デフォルトデバイス",
-                    "is_default": True
-                })
-            except:
-                pass
+            devices.append({
+                "id": "default",
+                "name": "デフォルトデバイス",
+                "is_default": True
+            })
 
         return devices
 
@@ -279,27 +435,10 @@ class VolumeControl:
         """
         with self._lock:
             try:
-                from comtypes import CoCreateInstance, GUID
-                from pycaw.pycaw import EDataFlow, ERole
-
                 log(f"🔄 オーディオデバイスを切り替えています: {device_id}")
 
-                # CLSID_MMDeviceEnumeratorを直接定義
-                CLSID_MMDeviceEnumerator = GUID('{BCDE0395-E52F-467C-8E3D-C4579291692E}')
-
-                # デバイス列挙子を取得
-                device_enum = CoCreateInstance(
-                    CLSID_MMDeviceEnumerator,
-                    IMMDeviceEnumerator,
-                    CLSCTX_ALL
-                )
-
-                # 指定されたIDのデバイスを取得
-                device = device_enum.GetDevice(device_id)
-
-                # デバイスのインターフェースを取得
-                interface = device.Activate(IAudioEndpointVolume._iid_, CLSCTX_ALL, None)
-                self.volume = cast(interface, POINTER(IAudioEndpointVolume))
+                # アクティベート済みのインターフェースがあれば再利用する
+                self._attach_device(device_id)
 
                 log("✅ オーディオデバイスの切り替えが完了しました")
             except Exception as e:
@@ -307,8 +446,44 @@ class VolumeControl:
                 # エラーが発生した場合はデフォルトデバイスに戻す
                 self._initialize_device()
 
+    def toggle_mic_mute(self):
+        """既定の録音デバイスのミュートを切り替える
+
+        Returns:
+            bool: 切り替え後のミュート状態（録音デバイスがない場合はNone）
+        """
+        with self._mic_lock:
+            try:
+                mic = self.registry.get_default_volume(CAPTURE)
+                if mic is None:
+                    log("⚠️ 録音デバイスが見つかりません")
+                    return None
+                new_state = not bool(mic.GetMute())
+                mic.SetMute(new_state, EVENT_CONTEXT)
+                log(f"🎤 マイクを{'ミュート' if new_state else 'ミュート解除'}しました")
+                self._publish(MicMuteChanged(muted=new_state, device_id=self.registry.get_default_id(CAPTURE)))
+                return new_state
+            except Exception as e:
+                log(f"❌ マイクミュート切り替えエラー: {e}")
+                return None
+
+    def is_mic_muted(self):
+        """既定の録音デバイスがミュートされているか"""
+        with self._mic_lock:
+            try:
+                mic = self.registry.get_default_volume(CAPTURE)
+                return bool(mic.GetMute()) if mic is not None else False
+            except Exception as e:
+                log(f"❌ マイクミュート状態取得エラー: {e}")
+                return False
+
     def cleanup(self):
         """クリーンアップ処理"""
+        try:
+            if self.volume is not None and self.volume_callback is not None:
+                self.volume.UnregisterControlChangeNotify(self.volume_callback)
+        except Exception as e:
+            log(f"❌ 音量変更通知の登録解除エラー: {e}")
         try:
             if self.notification_client and self.device_enumerator:
                 log("🧹 デバイス変更通知の登録を解除しています...")
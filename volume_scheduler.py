@@ -0,0 +1,466 @@
+"""
+音量自動化スケジューラモジュール
+
+設定ファイルの "volume_rules" に書かれた時刻ベースのルールを、
+ヒープで管理した1本のスレッドで実行する。
+
+ルールの例:
+    {"id": "night-cap", "time": "22:00", "until": "07:00", "action": "cap", "value": 30}
+    {"id": "weekday-mute", "time": "09:00", "days": [0, 1, 2, 3, 4], "action": "mute"}
+    {"id": "morning", "time": "09:00", "action": "set", "value": 60}
+
+action:
+    set     音量を value% に設定する
+    cap     time から until までの間、音量の上限を value% にする（ホットキー等の操作にも適用）。
+            until を省略した場合は、次に別のルールが実行されるまで
+    mute    ミュートする
+    unmute  ミュートを解除する
+
+days は曜日（月曜=0〜日曜=6）のリスト。省略時は毎日。
+起動時やルール変更時に cap の期間内であれば、その場で上限を適用する。
+"""
+import ctypes
+import heapq
+import itertools
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+
+ACTIONS = ("set", "cap", "mute", "unmute")
+# 予定時刻をこれ以上過ぎていた場合（スリープ復帰など）は実行せず次回に回す（秒）
+MISSED_GRACE = 300
+# 壁時計とモノトニック時計のずれがこれを超えたら時計の変更とみなす（秒）
+CLOCK_JUMP_THRESHOLD = 2.0
+# ヒープ要素の種類
+START = "start"
+END = "end"
+
+def log(message):
+    print(f"⏰ {message}")
+
+def _rule_key(rule):
+    """ルールの識別子（idがなければ内容から作る）"""
+    if rule.get("id"):
+        return str(rule["id"])
+    return f"{rule.get('time')}/{rule.get('action')}/{rule.get('value')}/{rule.get('days')}"
+
+def _parse_time(value):
+    hour, minute = (int(part) for part in str(value or "").split(":"))
+    if not (0 <= hour < 24 and 0 <= minute < 60):
+        raise ValueError(f"不正な時刻: {value}")
+    return hour, minute
+
+def _validate_rule(rule):
+    if rule.get("action") not in ACTIONS:
+        raise ValueError(f"不明なアクション: {rule.get('action')}")
+    _parse_time(rule.get("time"))
+    if rule.get("action") in ("set", "cap"):
+        int(rule["value"])
+    if rule.get("until") is not None:
+        if rule.get("action") != "cap":
+            raise ValueError("until は cap でのみ使用できます")
+        _parse_time(rule["until"])
+    for day in rule.get("days") or []:
+        if not 0 <= int(day) <= 6:
+            raise ValueError(f"不正な曜日: {day}")
+
+def next_occurrence(rule, after):
+    """ruleが次に実行される時刻を求める
+
+    Args:
+        rule: ルール
+        after: 基準時刻（datetime）。この時刻より後の最初の実行時刻を返す
+
+    Returns:
+        datetime: 次回実行時刻
+    """
+    hour, minute = _parse_time(rule["time"])
+    days = set(int(day) for day in (rule.get("days") or range(7)))
+    candidate = after.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    if candidate <= after:
+        candidate += timedelta(days=1)
+    for _ in range(7):
+        if candidate.weekday() in days:
+            return candidate
+        candidate += timedelta(days=1)
+    return candidate
+
+def previous_occurrence(rule, before):
+    """ruleが最後に実行された（はずの）時刻を求める
+
+    Args:
+        rule: ルール
+        before: 基準時刻（datetime）。この時刻以前で最後の実行時刻を返す
+
+    Returns:
+        datetime: 前回実行時刻
+    """
+    hour, minute = _parse_time(rule["time"])
+    days = set(int(day) for day in (rule.get("days") or range(7)))
+    candidate = before.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    if candidate > before:
+        candidate -= timedelta(days=1)
+    for _ in range(7):
+        if candidate.weekday() in days:
+            return candidate
+        candidate -= timedelta(days=1)
+    return candidate
+
+def cap_window_end(rule, started):
+    """startedに始まったcapの終了時刻（untilがなければNone）"""
+    if rule.get("until") is None:
+        return None
+    return next_occurrence({"time": rule["until"]}, started)
+
+class _WallClockWaiter:
+    """壁時計の時刻まで待機する
+
+    Windowsでは絶対時刻を指定した Waitable Timer を使うため、待機中に時計が
+    変更されても予定時刻どおりに起きる（定期的に起きて確認する必要がない）。
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._timer = None
+        if sys.platform == 'win32':
+            kernel32 = ctypes.windll.kernel32
+            self._timer = kernel32.CreateWaitableTimerW(None, True, None)
+            # 自動リセットのイベント（wake()用）
+            self._wake_event = kernel32.CreateEventW(None, False, False, None)
+
+    def wake(self):
+        """待機中のwait_until()を直ちに戻す（待機前に呼ばれた場合は次のwait_until()が即座に戻る）"""
+        if self._timer:
+            ctypes.windll.kernel32.SetEvent(self._wake_event)
+        else:
+            self._event.set()
+
+    def wait_until(self, due_ts):
+        """due_ts（time.time()の値）まで、またはwake()まで待機する。Noneなら無期限"""
+        if self._timer:
+            kernel32 = ctypes.windll.kernel32
+            handles = [self._wake_event]
+            if due_ts is not None:
+                # FILETIME（1601年からの100ナノ秒単位）の正の値は絶対時刻として扱われる
+                due_time = ctypes.c_longlong(int(due_ts * 10_000_000) + 116444736000000000)
+                kernel32.SetWaitableTimer(self._timer, ctypes.byref(due_time), 0, None, None, False)
+                handles.append(self._timer)
+            array = (ctypes.c_void_p * len(handles))(*handles)
+            kernel32.WaitForMultipleObjects(len(handles), array, False, 0xFFFFFFFF)  # INFINITE
+        else:
+            self._event.wait(None if due_ts is None else max(0.0, due_ts - time.time()))
+            self._event.clear()
+
+class VolumeScheduler:
+    def __init__(self, volume_control):
+        """
+        スケジューラを初期化
+
+        Args:
+            volume_control: VolumeControlのインスタンス（適用結果はそのイベントバスで通知される）
+        """
+        self.volume_control = volume_control
+        self._lock = threading.Lock()
+        self._waiter = _WallClockWaiter()
+        # ヒープの要素: (時刻のタイムスタンプ, 連番, ルールキー, 世代, START/END)
+        self._heap = []
+        self._counter = itertools.count()
+        # ルールキー -> (ルール, 世代)。世代が一致しないヒープ要素は無効
+        self._rules = {}
+        self._generation = itertools.count(1)
+        # 期間中の cap: ルールキー -> (上限, 世代, 開始時刻のタイムスタンプ)
+        self._active_caps = {}
+        # ルールキー -> 最後に処理した開始予定（時計が戻っても同じ回を二度実行しない）
+        self._last_started = {}
+        # VolumeControl に設定済みの上限（set_volume_limitの呼び出しを直列化する）
+        self._limit_lock = threading.Lock()
+        self._applied_limit = None
+        self._thread = None
+        self._stopped = False
+        self._metrics = {
+            "evaluations": 0,
+            "evaluation_total_ms": 0.0,
+            "evaluation_max_ms": 0.0,
+            "replans": 0,
+            "clock_jumps": 0,
+            "skipped": 0,
+        }
+        self._rule_metrics = {}
+
+    def start(self):
+        """スケジューラスレッドを開始する"""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._stopped = False
+            self._thread = threading.Thread(target=self._run, name="volume-scheduler", daemon=True)
+            self._thread.start()
+        log("▶️ 音量スケジューラを開始しました")
+
+    def stop(self):
+        """スケジューラスレッドを停止する"""
+        with self._lock:
+            thread = self._thread
+            self._stopped = True
+        self._waiter.wake()
+        if thread is not None:
+            thread.join()
+        self._thread = None
+        log("🛑 音量スケジューラを停止しました")
+
+    def update_rules(self, rules):
+        """ルール一覧を差し替える。変更のあったルールだけを再計画する
+
+        Args:
+            rules: ルールのリスト
+        """
+        new_rules = {}
+        for rule in rules or []:
+            if not rule.get("enabled", True):
+                continue
+            try:
+                _validate_rule(rule)
+            except Exception as e:
+                log(f"⚠️ ルールを無視します ({rule}): {e}")
+                continue
+            new_rules[_rule_key(rule)] = dict(rule)
+
+        now = datetime.now()
+        with self._lock:
+            changed = 0
+            # 削除・変更されたルールは世代を捨てるだけ（ヒープ上の要素は取り出し時に無視）
+            for key in list(self._rules):
+                if key not in new_rules or new_rules[key] != self._rules[key][0]:
+                    del self._rules[key]
+                    self._rule_metrics.pop(key, None)
+                    self._active_caps.pop(key, None)
+                    self._last_started.pop(key, None)
+                    changed += 1
+            added = [key for key in new_rules if key not in self._rules]
+            # capの期間判定で他のルールを参照するため、先にすべて登録してから予約する
+            for key in added:
+                self._rules[key] = (new_rules[key], next(self._generation))
+            for key in added:
+                self._schedule_start_locked(key, now)
+            changed += len(added)
+            if changed:
+                self._metrics["replans"] += 1
+                self._compact_locked()
+        if changed:
+            self._sync_limit()
+            self._waiter.wake()
+            log(f"🔄 ルールを再計画しました (変更: {changed}件, 有効: {len(new_rules)}件)")
+
+    def _push_locked(self, due, key, generation, kind):
+        heapq.heappush(self._heap, (due, next(self._counter), key, generation, kind))
+
+    def _schedule_start_locked(self, key, now, resume_missed=False):
+        """ルールの次回実行を予約する。capの期間内であれば直ちに実行する
+
+        Args:
+            resume_missed: Trueなら、MISSED_GRACE以内に過ぎてまだ処理していない回を予約する
+                           （時計の変更を検出した起床時に、その時刻のルールを捨てないため）
+        """
+        rule, generation = self._rules[key]
+        if rule["action"] == "cap" and self._cap_active_at_locked(key, rule, now):
+            self._push_locked(now.timestamp(), key, generation, START)
+            return
+        last_started = self._last_started.get(key)
+        if resume_missed:
+            previous = previous_occurrence(rule, now)
+            if (now - previous).total_seconds() <= MISSED_GRACE and (
+                    last_started is None or previous.timestamp() > last_started):
+                self._push_locked(previous.timestamp(), key, generation, START)
+                return
+        due = next_occurrence(rule, now)
+        if last_started is not None and due.timestamp() <= last_started:
+            # 時計が戻った: 処理済みの回は飛ばす
+            due = next_occurrence(rule, due)
+        self._push_locked(due.timestamp(), key, generation, START)
+
+    def _cap_active_at_locked(self, key, rule, now):
+        """capの期間内かどうか（直近の開始時刻から判定する）"""
+        started = previous_occurrence(rule, now)
+        end = cap_window_end(rule, started)
+        if end is not None:
+            return now < end
+        # untilがない場合は、開始後に別のルールが実行されていなければ期間内
+        return not any(
+            started < previous_occurrence(other, now)
+            for other_key, (other, _) in self._rules.items()
+            if other_key != key
+        )
+
+    def _compact_locked(self):
+        """無効になった要素がヒープの大半を占めたら作り直す"""
+        if len(self._heap) > 3 * len(self._rules) + 8:
+            self._heap = [entry for entry in self._heap if self._is_valid_locked(entry)]
+            heapq.heapify(self._heap)
+
+    def _is_valid_locked(self, entry):
+        rule_entry = self._rules.get(entry[2])
+        return rule_entry is not None and rule_entry[1] == entry[3]
+
+    def _replan_all_locked(self):
+        """時計の変更時などに、すべてのルールの予定を計算し直す"""
+        now = datetime.now()
+        self._heap = []
+        self._active_caps = {}
+        # 世代を更新して、古い終了予定を無効にする
+        for key, (rule, _) in list(self._rules.items()):
+            self._rules[key] = (rule, next(self._generation))
+        for key in self._rules:
+            self._schedule_start_locked(key, now, resume_missed=True)
+        self._metrics["replans"] += 1
+
+    def _effective_limit_locked(self):
+        return min((cap[0] for cap in self._active_caps.values()), default=None)
+
+    def _sync_limit(self):
+        """期間中のcapの最小値を VolumeControl の音量上限に反映する"""
+        with self._limit_lock:
+            with self._lock:
+                limit = self._effective_limit_locked()
+            if limit == self._applied_limit:
+                return
+            self.volume_control.set_volume_limit(limit)
+            self._applied_limit = limit
+        log(f"🔒 音量の上限: {'なし' if limit is None else f'{limit}%'}")
+
+    def _run(self):
+        import comtypes
+        comtypes.CoInitialize()
+        try:
+            self._loop()
+        except Exception as e:
+            log(f"❌ スケジューラエラー: {e}")
+        finally:
+            comtypes.CoUninitialize()
+
+    def _loop(self):
+        while True:
+            with self._lock:
+                if self._stopped:
+                    return
+                # 無効な要素を取り除く
+                while self._heap and not self._is_valid_locked(self._heap[0]):
+                    heapq.heappop(self._heap)
+                due_ts = self._heap[0][0] if self._heap else None
+                wall_before = time.time()
+                mono_before = time.monotonic()
+
+            if due_ts is None or due_ts > wall_before:
+                # 次の予定時刻まで（またはルール変更・停止まで）眠る。定期的には起きない
+                self._waiter.wait_until(due_ts)
+                drift = (time.time() - wall_before) - (time.monotonic() - mono_before)
+                if abs(drift) > CLOCK_JUMP_THRESHOLD:
+                    log(f"🕒 時計の変更を検出しました ({drift:+.1f}秒)。ルールを再計画します")
+                    with self._lock:
+                        self._metrics["clock_jumps"] += 1
+                        self._replan_all_locked()
+                continue
+
+            due_rules = []
+            with self._lock:
+                now_ts = time.time()
+                while self._heap and self._heap[0][0] <= now_ts:
+                    entry = heapq.heappop(self._heap)
+                    if self._is_valid_locked(entry):
+                        self._handle_due_locked(entry, now_ts, due_rules)
+
+            # 上限の変更と音量操作はロックの外で行う
+            self._sync_limit()
+            for key, rule in due_rules:
+                self._apply_rule(key, rule)
+
+    def _handle_due_locked(self, entry, now_ts, due_rules):
+        due, _, key, generation, kind = entry
+        rule = self._rules[key][0]
+        if kind == END:
+            if key in self._active_caps and self._active_caps[key][1] == generation:
+                del self._active_caps[key]
+            return
+
+        self._last_started[key] = due
+        now = datetime.fromtimestamp(now_ts)
+        if rule["action"] == "cap":
+            # スリープ復帰などで開始を過ぎていても、期間内であれば適用する
+            run = self._cap_active_at_locked(key, rule, now) if now_ts - due > MISSED_GRACE else True
+        else:
+            run = now_ts - due <= MISSED_GRACE
+        if run:
+            # capは期間の途中から適用した場合も、本来の開始時刻を実行時刻とする
+            started = previous_occurrence(rule, now) if rule["action"] == "cap" else datetime.fromtimestamp(due)
+            # untilのないcapは、より後の時刻に別のルールが実行された時点で終わる
+            # （同時刻のルールは処理順によらず終わらせない。_cap_active_at_locked と同じ判定）
+            for cap_key, cap in list(self._active_caps.items()):
+                if (cap_key != key and cap[2] < started.timestamp()
+                        and self._rules[cap_key][0].get("until") is None):
+                    del self._active_caps[cap_key]
+            if rule["action"] == "cap":
+                self._active_caps[key] = (int(rule["value"]), generation, started.timestamp())
+                end = cap_window_end(rule, started)
+                if end is not None:
+                    self._push_locked(end.timestamp(), key, generation, END)
+            due_rules.append((key, rule))
+        else:
+            self._metrics["skipped"] += 1
+        # 次回の実行を予約（同じ世代のまま）
+        next_due = next_occurrence(rule, datetime.fromtimestamp(max(due, now_ts))).timestamp()
+        self._push_locked(next_due, key, generation, START)
+
+    def _apply_rule(self, key, rule):
+        action = rule["action"]
+        started = time.perf_counter()
+        try:
+            if action == "set":
+                ops = [("set", int(rule["value"]))]
+            elif action == "cap":
+                ops = [("cap", int(rule["value"]))]
+            else:
+                ops = [("mute", action == "mute")]
+            ops += [("get",), ("is_muted",)]
+            results = self.volume_control.batch(ops)
+            error = next((r for r in results if isinstance(r, Exception)), None)
+            if error is not None:
+                raise error
+            state = {"volume": results[-2], "muted": results[-1]}
+            log(f"✅ ルール '{key}' を適用しました ({action}): {state['volume']}%"
+                f"{' (ミュート)' if state['muted'] else ''}")
+        except Exception as e:
+            state = None
+            log(f"❌ ルール '{key}' の適用エラー: {e}")
+        elapsed_ms = (time.perf_counter() - started) * 1000
+
+        with self._lock:
+            self._metrics["evaluations"] += 1
+            self._metrics["evaluation_total_ms"] += elapsed_ms
+            self._metrics["evaluation_max_ms"] = max(self._metrics["evaluation_max_ms"], elapsed_ms)
+            m = self._rule_metrics.setdefault(key, {"runs": 0, "errors": 0, "total_ms": 0.0, "max_ms": 0.0})
+            m["runs"] += 1
+            m["total_ms"] += elapsed_ms
+            m["max_ms"] = max(m["max_ms"], elapsed_ms)
+            m["last_run"] = datetime.now().isoformat(timespec='seconds')
+            if state is None:
+                m["errors"] += 1
+
+    def get_next_runs(self):
+        """各ルールの次回実行時刻を返す"""
+        with self._lock:
+            result = {}
+            for due, _, key, generation, kind in self._heap:
+                if kind == START and self._is_valid_locked((due, None, key, generation)):
+                    result[key] = datetime.fromtimestamp(due).isoformat(timespec='seconds')
+            return result
+
+    def get_metrics(self):
+        """ルール評価のコストなどの計測値を返す"""
+        with self._lock:
+            metrics = dict(self._metrics)
+            metrics["rules"] = len(self._rules)
+            metrics["heap_size"] = len(self._heap)
+            metrics["volume_limit"] = self._effective_limit_locked()
+            metrics["active_caps"] = sorted(self._active_caps)
+            metrics["per_rule"] = {key: dict(m) for key, m in self._rule_metrics.items()}
+            return metrics